@@ -0,0 +1,253 @@
+"""
+Streamlit-free query layer over the dashboard data, for analytics jobs and other programmatic clients.
+
+Every query runs against one in-memory copy of the merged data of its season (a "season" argument,
+defaulting to functions.CURRENT_SEASON), loaded on first use and reloaded when a workbook changes. Run this file to serve the queries over HTTP on localhost:
+
+    python api.py --port 8502
+
+    curl localhost:8502/query -d '{"op": "leaders", "league": "Serie A", "metric": "Assists"}'
+    curl localhost:8502/query -d '[{"op": "scatter", "x": "Key Passes", "y": "Expected Assists", "min_minutes": 900},
+                                   {"op": "compare", "player_1": "Rodri", "player_2": "Declan Rice"}]'
+
+A list body is a batch: its queries are answered in order, in a single response.
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import functions
+
+
+_lock = threading.RLock()
+_cache = {}
+
+
+def dataset(season=functions.CURRENT_SEASON):
+    """
+    Returns a season's lazily loaded data, see functions.Dataset. It is replaced, dropping everything
+    built from it, whenever one of the season's workbooks changes; seasons are only loaded once queried.
+    """
+    if season not in functions.SEASONS:
+        raise KeyError(f"Unknown season {season!r}")
+    fingerprint = functions.data_fingerprint(season=season)
+    with _lock:
+        if season not in _cache or _cache[season][0] != fingerprint:
+            _cache[season] = (fingerprint, functions.Dataset(season))
+        return _cache[season][1]
+
+
+def records(df):
+    """
+    Converts a dataframe to JSON-ready records. float32 stats are rounded to 4 decimals, which keeps
+    every FBref value and drops the float32 noise.
+    """
+    df = df.astype({column: "float64" for column in df.columns if df[column].dtype == "float32"}).round(4)
+    df = df.astype({column: object for column in df.columns if df[column].dtype == "category"})
+    return json.loads(df.to_json(orient="records"))
+
+
+def resolve_player(index, player, squad=None):
+    """
+    Finds a player's (Player, Squad) key.\n
+
+    Args:
+        index - A (Player, Squad) index, e.g. of radar_table.
+        player - Player name.
+        squad - Squad, for players who appear for several. Defaults to the player's first squad.
+
+    Returns:
+        The (Player, Squad) key.
+    """
+    if squad is not None:
+        if (player, squad) not in index:
+            raise KeyError(f"{player} ({squad}) not found")
+        return (player, squad)
+    squads = index[index.get_level_values("Player") == player]
+    if len(squads) == 0:
+        raise KeyError(f"{player} not found")
+    return squads[0]
+
+
+def leaders(metric="Goals Scored", league=None, per_90=False, top=10, offset=0, season=functions.CURRENT_SEASON):
+    """
+    Ranks players by a metric, as on the "Stat Leaders" page.\n
+
+    Args:
+        metric - Column to rank by.
+        league - League name. Defaults to all leagues.
+        per_90 - Rank per 90 stats instead of raw totals.
+        top, offset - Page of the ranking to return.
+        season - Season, a functions.SEASONS key.
+
+    Returns:
+        Records of Player, Squad, League and the metric, best first.
+    """
+    data = dataset(season)
+    frame = data.per_90 if per_90 else data.raw
+    index = data.leaderboards(per_90=per_90)
+    if league not in index:
+        raise KeyError(f"Unknown league {league!r}")
+    if metric not in index[league].columns:
+        raise KeyError(f"Unknown metric {metric!r}")
+    return records(functions.leaderboard(frame, index, metric, league=league, top=top, offset=offset))
+
+
+def scatter(x, y, min_minutes=0, leagues=None, season=functions.CURRENT_SEASON):
+    """
+    Returns the data behind a "Plot Metrics" scatter chart.\n
+
+    Args:
+        x, y - scatter_variables columns on each axis.
+        min_minutes - Only players with more minutes than this are returned.
+        leagues - League names. Defaults to all leagues.
+        season - Season, a functions.SEASONS key.
+
+    Returns:
+        Records of Player, Squad, League, x and y, per 90, from fewest to most minutes played.
+    """
+    dat = functions.above_minutes(*dataset(season).minutes, min_minutes)
+    if leagues is not None:
+        dat = dat[dat["League"].isin(leagues)]
+    return records(dat[list(dict.fromkeys(["Player","Squad","League",x,y]))])
+
+
+def percentiles(players, template=None, min_minutes=0, leagues=None, by_position=False, season=functions.CURRENT_SEASON):
+    """
+    Looks up players' percentile ranks within a player pool.\n
+
+    Args:
+        players - Player names, or [player, squad] pairs.
+        template - Radar template whose metrics are returned. Defaults to every metric.
+        min_minutes, leagues, by_position - The player pool, see functions.percentile_table. min_minutes is
+                                            rounded down to a functions.MINUTES_STEP multiple.
+        season - Season, a functions.SEASONS key.
+
+    Returns:
+        One record per player, holding Player, Squad and a percentile per metric.
+    """
+    table = dataset(season).percentiles(min_minutes=min_minutes, leagues=leagues, by_position=by_position)
+    if template is not None:
+        table = table[functions.TEMPLATES[template]]
+    keys = [resolve_player(table.index, *([player] if isinstance(player, str) else player)) for player in players]
+    return records(table.loc[keys].reset_index())
+
+
+def compare(player_1, player_2, template="Attacking Template", mode="per_90", squad_1=None, squad_2=None,
+            min_minutes=0, by_position=False, season=functions.CURRENT_SEASON):
+    """
+    Returns the data behind a "Player Comparison" radar chart.\n
+
+    Args:
+        player_1, player_2 - Player names.
+        template - Radar template.
+        mode - "per_90" or "percentile".
+        squad_1, squad_2 - Squads, for players who appear for several.
+        min_minutes, by_position - Player pool of the percentile mode, see functions.percentile_table.
+        season - Season, a functions.SEASONS key.
+
+    Returns:
+        The template's params, their axis ranges, and each player's squad and values.
+    """
+    params = functions.TEMPLATES[template]
+    if mode == "percentile":
+        rdat = dataset(season).percentiles(min_minutes=min_minutes, by_position=by_position)
+        ranges = [(0, 100)] * len(params)
+    else:
+        rdat, ranges = dataset(season).radar
+        ranges = [[round(float(value), 4) for value in row] for row in ranges.loc[params].itertuples(index=False)]
+
+    players = []
+    for player, squad in [(player_1, squad_1), (player_2, squad_2)]:
+        key = resolve_player(rdat.index, player, squad)
+        values = [round(float(value), 4) for value in rdat.loc[key, params]]
+        players.append({"Player": key[0], "Squad": key[1], "values": values})
+    return {"params": params, "ranges": ranges, "players": players}
+
+
+def similar(player, squad=None, template=None, top=10, min_minutes=0, normalize="zscore",
+            season=functions.CURRENT_SEASON):
+    """
+    Finds the players most similar to a player, across all leagues.\n
+
+    Args:
+        player - Player name.
+        squad - Squad, for players who appear for several.
+        template - Radar template whose metrics are compared. Defaults to every metric.
+        top - Number of players to return.
+        min_minutes - Only players with more minutes than this are searched, rounded down to a
+                      functions.MINUTES_STEP multiple.
+        normalize - "zscore" or "percentile", see functions.similarity_index.
+        season - Season, a functions.SEASONS key.
+
+    Returns:
+        Records of Player, Squad, League and Similarity, most similar first.
+    """
+    players, matrices = dataset(season).similarity(min_minutes=min_minutes, normalize=normalize)
+    if template is not None and template not in matrices:
+        raise KeyError(f"Unknown template {template!r}")
+    key = resolve_player(players.set_index(["Player","Squad"]).index, player, squad)
+    return records(functions.similar_players(players, matrices, key, template=template, top=top))
+
+
+OPERATIONS = {"leaders": leaders,
+              "scatter": scatter,
+              "percentiles": percentiles,
+              "compare": compare,
+              "similar": similar}
+
+
+def query(request):
+    """
+    Answers one query or a batch of them.\n
+
+    Args:
+        request - A dict {"op": operation name, **arguments}, or a list of such dicts.
+
+    Returns:
+        {"result": ...} or {"error": message} for a single query, a list of them for a batch. A failing
+        query only fails its own item of a batch.
+    """
+    if isinstance(request, list):
+        return [query(item) for item in request]
+    try:
+        arguments = dict(request)
+        operation = OPERATIONS[arguments.pop("op")]
+        return {"result": operation(**arguments)}
+    except Exception as error:
+        return {"error": f"{type(error).__name__}: {error}"}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Serves POST /query, with a JSON query or batch as the body.
+    """
+    def do_POST(self):
+        if self.path != "/query":
+            self.send_error(404)
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            self.send_error(400, "Body must be JSON")
+            return
+        body = json.dumps(query(request)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve dashboard queries over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args()
+
+    # Builds the raw and per 90 frames up front, so the first queries don't wait on them.
+    dataset().raw, dataset().per_90
+    server = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+    print(f"Serving queries on http://{args.host}:{args.port}/query")
+    server.serve_forever()
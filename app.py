@@ -2,6 +2,7 @@ import pandas as pd
 import streamlit as st 
 import matplotlib.pyplot as plt
 import functions
+import timing
 import plotly.graph_objects as go
 import altair as alt
 from soccerplots.radar_chart import Radar
@@ -9,196 +10,109 @@ from streamlit_option_menu import option_menu
 
 ##################################################################################################
 # Data Importation
-## Ligue 1
-### Raw
-li_defe = pd.read_excel("data/li_defensive_actions.xlsx", sheet_name="raw")
-li_std=pd.read_excel("data/li_standard.xlsx", sheet_name="raw")
-li_poss = pd.read_excel("data/li_possession.xlsx", sheet_name="raw")
-li_pass = pd.read_excel("data/li_passing.xlsx", sheet_name="raw")
-li_ptype=pd.read_excel("data/li_pass_types.xlsx", sheet_name="raw")
-li_misc = pd.read_excel("data/li_misc.xlsx", sheet_name="raw")
-li_league = "Ligue 1"
-### Per 90
-li_defe_1 = pd.read_excel("data/li_defensive_actions.xlsx", sheet_name="per_90")
-li_std_1 =pd.read_excel("data/li_standard.xlsx", sheet_name="per_90")
-li_poss_1 = pd.read_excel("data/li_possession.xlsx", sheet_name="per_90")
-li_pass_1 = pd.read_excel("data/li_passing.xlsx", sheet_name="per_90")
-li_ptype_1 =pd.read_excel("data/li_pass_types.xlsx", sheet_name="per_90")
-li_misc_1 = pd.read_excel("data/li_misc.xlsx", sheet_name="per_90")
-li_league_1 = "Ligue 1"
-
-
-## Premier League
-### Raw
-pl_defe = pd.read_excel("data/pl_defensive_actions.xlsx", sheet_name="raw")
-pl_std=pd.read_excel("data/pl_standard.xlsx", sheet_name="raw")
-pl_poss = pd.read_excel("data/pl_possession.xlsx", sheet_name="raw")
-pl_pass = pd.read_excel("data/pl_passing.xlsx", sheet_name="raw")
-pl_ptype=pd.read_excel("data/pl_pass_types.xlsx", sheet_name="raw")
-pl_misc = pd.read_excel("data/pl_misc.xlsx", sheet_name="raw")
-pl_league = "Premier League"
-### Raw
-pl_defe_1 = pd.read_excel("data/pl_defensive_actions.xlsx", sheet_name="per_90")
-pl_std_1 =pd.read_excel("data/pl_standard.xlsx", sheet_name="per_90")
-pl_poss_1 = pd.read_excel("data/pl_possession.xlsx", sheet_name="per_90")
-pl_pass_1 = pd.read_excel("data/pl_passing.xlsx", sheet_name="per_90")
-pl_ptype_1 =pd.read_excel("data/pl_pass_types.xlsx", sheet_name="per_90")
-pl_misc_1 = pd.read_excel("data/pl_misc.xlsx", sheet_name="per_90")
-pl_league_1 = "Premier League"
-
-## La Liga
-### Raw
-ll_defe = pd.read_excel("data/ll_defensive_actions.xlsx", sheet_name="raw")
-ll_std=pd.read_excel("data/ll_standard.xlsx", sheet_name="raw")
-ll_poss = pd.read_excel("data/ll_possession.xlsx", sheet_name="raw")
-ll_pass = pd.read_excel("data/ll_passing.xlsx", sheet_name="raw")
-ll_ptype=pd.read_excel("data/ll_pass_types.xlsx", sheet_name="raw")
-ll_misc = pd.read_excel("data/ll_misc.xlsx", sheet_name="raw")
-ll_league = "La Liga"
-### Raw
-ll_defe_1 = pd.read_excel("data/ll_defensive_actions.xlsx", sheet_name="per_90")
-ll_std_1 =pd.read_excel("data/ll_standard.xlsx", sheet_name="per_90")
-ll_poss_1 = pd.read_excel("data/ll_possession.xlsx", sheet_name="per_90")
-ll_pass_1 = pd.read_excel("data/ll_passing.xlsx", sheet_name="per_90")
-ll_ptype_1 =pd.read_excel("data/ll_pass_types.xlsx", sheet_name="per_90")
-ll_misc_1 = pd.read_excel("data/ll_misc.xlsx", sheet_name="per_90")
-ll_league_1 = "La Liga"
-
-## Serie A
-### Raw
-sa_defe = pd.read_excel("data/sa_defensive_actions.xlsx", sheet_name="raw")
-sa_std=pd.read_excel("data/sa_standard.xlsx", sheet_name="raw")
-sa_poss = pd.read_excel("data/sa_posession.xlsx", sheet_name="raw")
-sa_pass = pd.read_excel("data/sa_passing.xlsx", sheet_name="raw")
-sa_ptype=pd.read_excel("data/sa_pass_types.xlsx", sheet_name="raw")
-sa_misc = pd.read_excel("data/sa_misc.xlsx", sheet_name="raw")
-sa_league = "Serie A"
-### Raw
-sa_defe_1 = pd.read_excel("data/sa_defensive_actions.xlsx", sheet_name="per_90")
-sa_std_1 =pd.read_excel("data/sa_standard.xlsx", sheet_name="per_90")
-sa_poss_1 = pd.read_excel("data/sa_posession.xlsx", sheet_name="per_90")
-sa_pass_1 = pd.read_excel("data/sa_passing.xlsx", sheet_name="per_90")
-sa_ptype_1 =pd.read_excel("data/sa_pass_types.xlsx", sheet_name="per_90")
-sa_misc_1 = pd.read_excel("data/sa_misc.xlsx", sheet_name="per_90")
-sa_league_1 = "Serie A"
-
-
-## Bundesliga
-### Raw
-bl_defe = pd.read_excel("data/bl_defensive_actions.xlsx", sheet_name="raw")
-bl_std=pd.read_excel("data/bl_standard.xlsx", sheet_name="raw")
-bl_poss = pd.read_excel("data/bl_possession.xlsx", sheet_name="raw")
-bl_pass = pd.read_excel("data/bl_passing.xlsx", sheet_name="raw")
-bl_ptype=pd.read_excel("data/bl_pass_types.xlsx", sheet_name="raw")
-bl_misc = pd.read_excel("data/bl_misc.xlsx", sheet_name="raw")
-bl_league = "Bundesliga"
-### Raw
-bl_defe_1 = pd.read_excel("data/bl_defensive_actions.xlsx", sheet_name="per_90")
-bl_std_1 =pd.read_excel("data/bl_standard.xlsx", sheet_name="per_90")
-bl_poss_1 = pd.read_excel("data/bl_possession.xlsx", sheet_name="per_90")
-bl_pass_1 = pd.read_excel("data/bl_passing.xlsx", sheet_name="per_90")
-bl_ptype_1 =pd.read_excel("data/bl_pass_types.xlsx", sheet_name="per_90")
-bl_misc_1 = pd.read_excel("data/bl_misc.xlsx", sheet_name="per_90")
-bl_league_1 = "Bundesliga"
-
-###################################################################################################
-
-
-li = functions.merge_stats(league=li_league,
-                           std=li_std,
-                           poss=li_poss,
-                           pas=li_pass,
-                           ptype=li_ptype,
-                           misc=li_misc,
-                           defe=li_defe)
-li_1 = functions.merge_stats(league=li_league_1,
-                           std=li_std_1,
-                           poss=li_poss_1,
-                           pas=li_pass_1,
-                           ptype=li_ptype_1,
-                           misc=li_misc_1,
-                           defe=li_defe_1)
-
-pl = functions.merge_stats(league=pl_league,
-                           std=pl_std,
-                           poss=pl_poss,
-                           pas=pl_pass,
-                           ptype=pl_ptype,
-                           misc=pl_misc,
-                           defe=pl_defe)
-pl_1 = functions.merge_stats(league=pl_league_1,
-                           std=pl_std_1,
-                           poss=pl_poss_1,
-                           pas=pl_pass_1,
-                           ptype=pl_ptype_1,
-                           misc=pl_misc_1,
-                           defe=pl_defe_1)
-
-sa = functions.merge_stats(league=sa_league,
-                           std=sa_std,
-                           poss=sa_poss,
-                           pas=sa_pass,
-                           ptype=sa_ptype,
-                           misc=sa_misc,
-                           defe=sa_defe)
-sa_1 = functions.merge_stats(league=sa_league_1,
-                           std=sa_std_1,
-                           poss=sa_poss_1,
-                           pas=sa_pass_1,
-                           ptype=sa_ptype_1,
-                           misc=sa_misc_1,
-                           defe=sa_defe_1)
-
-ll = functions.merge_stats(league=ll_league,
-                           std=ll_std,
-                           poss=ll_poss,
-                           pas=ll_pass,
-                           ptype=ll_ptype,
-                           misc=ll_misc,
-                           defe=ll_defe)
-ll_1 = functions.merge_stats(league=ll_league_1,
-                           std=ll_std_1,
-                           poss=ll_poss_1,
-                           pas=ll_pass_1,
-                           ptype=ll_ptype_1,
-                           misc=ll_misc_1,
-                           defe=ll_defe_1)
-
-#bl = functions.merge_stats(league=bl_league,
-#                           std=bl_std,
-#                           poss=bl_poss,
-#                           pas=bl_pass,
- #                          ptype=bl_ptype,
-  #                         misc=bl_misc,
-   #                        defe=bl_defe)
-#bl_1 = functions.merge_stats(league=bl_league_1,
-#                          std=bl_std_1,
-#                           poss=bl_poss_1,
- #                          pas=bl_pass_1,
-  #                         ptype=bl_ptype_1,
-  #                         misc=bl_misc_1,
-   #                        defe=bl_defe_1)
-
-
-data = functions.merge_leagues(pl=pl, li=li,ll=ll,sa=sa)
-dat = functions.merge_leagues(pl=pl_1, li=li_1,ll=ll_1,sa=sa_1)
-
-st.header("23/24")
+# Streamlit reruns this script on every interaction, so the workbooks are read and merged once and
+# shared across reruns and sessions. Every league is cached on the fingerprint of its own workbooks, so
+# updating e.g. data/pl_passing.xlsx only re-reads that workbook and re-merges the Premier League.
+# Only the selected season is loaded, and only one season is kept in memory at a time; switching back
+# to a season reads its memory-mapped Feather copies again rather than its workbooks.
+# Nothing is loaded up front: functions.Dataset builds each table the first time a page reads it, e.g.
+# the Stat Leaders page never derives the per 90 stats. Percentile ranks are also kept on disk, per
+# player pool, so a pool is only ranked once per version of its leagues' workbooks.
+# cache_resource hands every session the same read-only frames instead of a copy each; pages must
+# not modify them in place. The merged frames and percentile tables are also shared between processes:
+# when several Streamlit servers run behind a load balancer, they all memory-map the copy published by
+# the first of them, or by publish.py, see functions.shared_frame.
+@st.cache_resource(max_entries=len(functions.LEAGUES), show_spinner=False)
+def load_league(league, sheet, season, fingerprint):
+    return functions.load_league(league, sheet, season)
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_dataset(fingerprint):
+    season, fingerprints = fingerprint
+    fingerprints = dict(fingerprints)
+    return functions.Dataset(season, loader=lambda league, sheet, season: load_league(league, sheet, season, fingerprints[league]))
+
+# Rendered radar charts, as PNG bytes. Scouts flick between the same comparisons, so a repeat is a
+# cache hit instead of a matplotlib draw; the least recently used charts are evicted.
+@st.cache_data(max_entries=256, show_spinner=False)
+def render_radar(fingerprint, template, player_1, player_2, mode, min_minutes=0, by_position=False):
+    params = functions.TEMPLATES[template]
+    if mode == "percentile":
+        percentiles = load_dataset(fingerprint).percentiles(min_minutes=min_minutes, by_position=by_position)
+        fig = functions.percentile_comparison_radar(rdat=percentiles[params], player_1=player_1, player_2=player_2,
+                                                    by_position=by_position)
+    else:
+        radar_data, ranges = load_dataset(fingerprint).radar
+        fig = functions.comparison_radar(rdat=radar_data[params], player_1=player_1, player_2=player_2, ranges=ranges)
+    return functions.figure_to_png(fig)
+
+# Scatter charts are cached as Vega-Lite specs, holding only the encoded columns, so scrubbing back to a
+# threshold or axis pair already drawn does not rebuild and reserialize the chart. Above MAX_POINTS
+# players a chart can be drawn as a grid of counts, which keeps its payload bounded as leagues are added.
+MAX_POINTS = 2000
+LEAGUE_COLORS = alt.Scale(
+    domain = ["Premier League","Ligue 1","La Liga", "Serie A", "Bundesliga"],
+    range = ["#FF0000","#00FFFF","#008000","#FFA500","#FFFF00"]
+)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def scatter_chart(fingerprint, x, y, min_minutes, title, width=None, binned=False):
+    table, minutes = load_dataset(fingerprint).minutes
+    dat = functions.above_minutes(table, minutes, min_minutes)
+    if binned and len(dat) > MAX_POINTS:
+        grid = functions.binned_counts(dat, x, y)
+        chart = alt.Chart(grid).mark_rect().encode(
+            x = alt.X("x_start", title=x), x2 = "x_end", y = alt.Y("y_start", title=y), y2 = "y_end",
+            color = alt.Color("Players", scale=alt.Scale(scheme="viridis")), tooltip=["Players"])
+    else:
+        # Per 90 stats are derived from the raw totals, so tooltips round them to 2 decimals, as FBref does.
+        chart = alt.Chart(dat[list(dict.fromkeys(["Player","League",x,y]))]).mark_point().encode(
+            x = x, y = y, color = alt.Color("League", scale=LEAGUE_COLORS),
+            tooltip=["Player",alt.Tooltip(x, format=".2~f"),alt.Tooltip(y, format=".2~f")])
+    chart = chart.properties(title=title)
+    if width is not None:
+        chart = chart.properties(width=width)
+    with timing.span("altair to_dict"):
+        return chart.to_dict()
+
+# Add ?debug=1 to the URL to time this session's reruns, see the panel at the bottom of the sidebar.
+debug = st.query_params.get("debug") == "1"
+timing.start_run(debug)
 
+with st.sidebar:
+    season = st.selectbox("Select Season:", list(functions.SEASONS),
+                          index=list(functions.SEASONS).index(functions.CURRENT_SEASON))
+
+fingerprint = (season, tuple((league, functions.data_fingerprint([league], season))
+                             for league in functions.season_leagues(season)))
+dataset = load_dataset(fingerprint)
+
+st.header(season)
+
+PAGES = ["Stat Leaders","Plot Metrics","Player Comparison"]
+
+# ?page=Plot+Metrics opens a page directly, e.g. from a shared link or the load test in loadtest.py.
 with st.sidebar:
     selected = option_menu(
         menu_title = "SELECT PAGE:",
-        options = ["Stat Leaders","Plot Metrics","Player Comparison"]
+        options = PAGES,
+        default_index = PAGES.index(st.query_params.get("page")) if st.query_params.get("page") in PAGES else 0
     )
 
 if selected == "Stat Leaders":
     st.subheader("STAT LEADERS")
 
+    with st.spinner("Loading league data..."), timing.span("raw data"):
+        data = dataset.raw
+        leaderboards = dataset.leaderboards()
+
     league, z,team = st.columns(3)
     with league:
         league = st.selectbox("Select League:", data["League"].unique())
+    with team:
+        top = st.number_input("Show top:", min_value=5, max_value=100, value=25, step=5)
 
-    filtered = data[data["League"]==league]
+    metrics = list(leaderboards[None].columns)
 
 
     gls, g_a, ast = st.columns(3)
@@ -206,50 +120,56 @@ if selected == "Stat Leaders":
     #Goals Table
     with gls:
         
-        gl = filtered[["Player", "Goals Scored","League","Squad"]]
-        gls = gl[(gl["League"]==league) ].sort_values(by="Goals Scored", ascending=False)
+        metric = st.selectbox("Select Stat:", metrics, index=metrics.index("Goals Scored"), key="leaders_left")
+        gls = functions.leaderboard(data, leaderboards, metric, league=league, top=top)
         fig = go.Figure(data=[go.Table(
         header=dict(
-            values=["Player","Goals Scored"],
+            values=["Player",metric],
             fill_color='Black',
             align='left'
         ),
         cells=dict(
-            values=[gls['Player'], gls['Goals Scored']],
+            values=[gls['Player'], gls[metric]],
+            format=[None, ".6~r"],
             fill_color='Black',
             align='left'
         )
         )])
-        fig.update_layout(title="Scoring Charts", width=400)
-        st.plotly_chart(fig)
+        fig.update_layout(title=f"{metric} Charts", width=400)
+        with timing.span("plotly_chart"):
+            st.plotly_chart(fig, key="leaders_left_chart")
 
     #Assists Table
     with ast:
         
-        asts = filtered[["Player", "Assists", "League","Squad"]]
-        ast = asts[(asts["League"]==league)].sort_values(by = "Assists", ascending=False)
+        metric = st.selectbox("Select Stat:", metrics, index=metrics.index("Assists"), key="leaders_right")
+        ast = functions.leaderboard(data, leaderboards, metric, league=league, top=top)
         fg = go.Figure(data=[go.Table(
         header=dict(
-            values=["Player","Assists"],
+            values=["Player",metric],
             fill_color='Black',
             align='left'
         ),
         cells=dict(
-            values=[ast['Player'], ast['Assists']],
+            values=[ast['Player'], ast[metric]],
+            format=[None, ".6~r"],
             fill_color='Black',
             align='left'
         )
         )])
-        fg.update_layout(title="Assists Charts", width = 400)
-        st.plotly_chart(fg)
+        fg.update_layout(title=f"{metric} Charts", width = 400)
+        with timing.span("plotly_chart"):
+            st.plotly_chart(fg, key="leaders_right_chart")
 
 elif selected == "Plot Metrics":
     st.subheader("Metrics")
 
 
-    minu=st.slider("Select Minimum Minutes Played:",min_value=100, max_value= max(dat["Minutes Played"]),step=100, value=900)
+    with st.spinner("Loading league data..."), timing.span("minutes table"):
+        table, minutes = dataset.minutes
+    minu=st.slider("Select Minimum Minutes Played:",min_value=100, max_value= int(minutes[-1]),step=100, value=900)
     st.markdown(f"### These stats are presented per 90 minutes for players accumulating a minimum of **{minu}** minutes across the league campaign")
-    dat = dat[dat["Minutes Played"]>minu]
+    binned = st.checkbox(f"Show counts instead of players when more than {MAX_POINTS} are plotted", value=True)
     one, two, three = st.columns(3)
 
     # Goals and Assist per 90.
@@ -257,75 +177,51 @@ elif selected == "Plot Metrics":
 
     with one:
         st.subheader("Goals and Assists per 90")
-        ga = dat[["Player","Squad","Goals Scored","Assists","League"]]
-
-        color_scale = alt.Scale(
-            domain = ["Premier League","Ligue 1","La Liga", "Serie A", "Bundesliga"],
-            range = ["#FF0000","#00FFFF","#008000","#FFA500","#FFFF00"]
-        )
-        chart = alt.Chart(ga).mark_point().encode(
-            x = "Goals Scored", y = 'Assists', color = alt.Color("League", scale=color_scale),
-            tooltip=["Player","Goals Scored","Assists"]).properties(title="Goals and Assists per 90")
+        with timing.span("vega_lite_chart"):
+            st.vega_lite_chart(spec=scatter_chart(fingerprint, "Goals Scored", "Assists", minu,
+                                                  title="Goals and Assists per 90", binned=binned))
 
         #text = chart.mark_text(
         #    align = "left",
         #    baseline = "middle",
         #    dx = 7
         #).encode(text="Player")
-            
-        st.altair_chart(chart)
 
 
     # Comparing two metrics
 
-    dat1 = functions.scatter_variables(dat)
+    metrics = table.columns[2:-1]
     with three:
         ex,yai = st.columns(2)
 
         with ex:
-            default_index = 12 if len(dat1.iloc[:,1:]) > 12 else 0
-            x = st.selectbox("Select a metric", dat1.iloc[:,2:].columns,index=default_index)
+            x = st.selectbox("Select a metric", metrics,index=12)
         with yai:
-            default_index_1 = 13 if len(dat1.iloc[:,1:]) > 13 else 0
-            y = st.selectbox("Select metric", dat1.iloc[:,2:].columns,index=default_index_1)
+            y = st.selectbox("Select metric", metrics,index=13)
 
-        color_scale = alt.Scale(
-            domain = ["Premier League","Ligue 1","La Liga", "Serie A", "Bundesliga"],
-            range = ["#FF0000","#00FFFF","#008000","#FFA500","#FFFF00"]
-        )
-        scatter = alt.Chart(dat1).mark_point().encode(
-            x = x, y = y, color = alt.Color("League", scale=color_scale),
-            tooltip=["Player",x,y]).properties(title=f"{x} per 90 vs {y} per 90, Minimum {minu} minutes", width =700)
-        st.altair_chart(scatter)    
+        with timing.span("vega_lite_chart"):
+            st.vega_lite_chart(spec=scatter_chart(fingerprint, x, y, minu, width=700, binned=binned,
+                                                  title=f"{x} per 90 vs {y} per 90, Minimum {minu} minutes"))
 
 elif selected == "Player Comparison":
 
-    dat1 = functions.scatter_variables(dat)
+    with st.spinner("Loading league data..."), timing.span("radar data"):
+        radar_data = dataset.radar[0]
     ### Radar Chart
 
     # Per_90 Stats
     st.subheader("Per_90 Data.")
-    template = st.radio("Select a template:",["Attacking Template","Possession Template","Defensive Template"])
+    template = st.radio("Select a template:",list(functions.TEMPLATES))
 
     p1, p3,p2 = st.columns(3)
     with p1:
-        player_1 = st.selectbox("Select player:",dat["Player"].unique(), index = 100)
+        player_1 = st.selectbox("Select player:",radar_data.index, index = 100, format_func=functions.player_label)
     with p2:
-        player_2 = st.selectbox("Select Player:",dat["Player"].unique(), index = 200)
-
+        player_2 = st.selectbox("Select Player:",radar_data.index, index = 200, format_func=functions.player_label)
 
-    if template == "Attacking Template":
-        rdat = dat1[["Player","Squad","Goals Scored","Assists","Dribbles Attempted","Dribble Success %","Key Passes","Crosses into the Penalty Area",
-                "Passes into the Penalty Area","Expected Goals","Expected Assists","xA Overperformance"]]
-    elif template == "Possession Template":
-        rdat = dat1[["Player","Squad","Pass Completion %","Progressive Passes","Carries","Progressive Carries","Progressive Carrying Distance",
-                    "Progressive Passing Distance","Through Balls","Touches","Progressive Passes Received","Key Passes",]]
-    elif template == "Defensive Template":
-        rdat = dat1[["Player","Squad","Recoveries","Tackles","Tackles Won","Tackle Success Rate","Interceptions","Clearances","Errors Leading to a Shot",
-                    "Fouls","Aerial Duel Success Rate"]]
 
-
-    functions.comparison_radar(rdat=rdat, player_1=player_1, player_2=player_2)
+    with timing.span("radar image"):
+        st.image(render_radar(fingerprint, template, player_1, player_2, mode="per_90"))
 
 
     ### Percentile Radar Plots
@@ -334,66 +230,52 @@ elif selected == "Player Comparison":
     
     st.subheader("PERCENTILES.")
 
-    perc_data = functions.get_percentiles(df =dat1, columns = dat1.columns)
+    by_position = st.checkbox("Rank players against their own position only", value=False)
+    with st.spinner("Ranking players..."), timing.span("percentiles"):
+        percentiles = dataset.percentiles(by_position=by_position)
 
-    template = st.radio("Select a Template:",["Attacking Template","Possession Template","Defensive Template"])
+    template = st.radio("Select a Template:",list(functions.TEMPLATES))
 
     aa, cc,bb = st.columns(3)
     with aa:
-        a = st.selectbox("Select Player",dat["Player"].unique(), index=300)
+        a = st.selectbox("Select Player",percentiles.index, index=300, format_func=functions.player_label)
     with bb:
-        b = st.selectbox("Select player",dat["Player"].unique(), index = 500)
-
-    if template == "Attacking Template":
-        perc_data = perc_data[["Player","Squad","Goals Scored","Assists","Dribbles Attempted","Dribble Success %","Key Passes","Crosses into the Penalty Area",
-                "Passes into the Penalty Area","Expected Goals","Expected Assists","xA Overperformance"]]
-    elif template == "Possession Template":
-        perc_data = perc_data[["Player","Squad","Pass Completion %","Progressive Passes","Carries","Progressive Carries","Progressive Carrying Distance",
-                    "Progressive Passing Distance","Through Balls","Touches","Progressive Passes Received","Key Passes",]]
-    elif template == "Defensive Template":
-        perc_data = perc_data[["Player","Squad","Recoveries","Tackles","Tackles Won","Tackle Success Rate","Interceptions","Clearances","Errors Leading to a Shot",
-                    "Fouls","Aerial Duel Success Rate"]]
-
-    
-
-    functions.percentile_comparison_radar(rdat = perc_data, player_1=a, player_2=b)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        b = st.selectbox("Select player",percentiles.index, index = 500, format_func=functions.player_label)
 
+    with timing.span("radar image"):
+        st.image(render_radar(fingerprint, template, a, b, mode="percentile", by_position=by_position))
 
 
+    ### Similar Players
+    st.text("")
+    st.text("")
 
+    st.subheader("SIMILAR PLAYERS.")
+    st.markdown("Players with the closest per 90 profile, across all leagues, among players with more than **900** minutes.")
+
+    with timing.span("similarity index"):
+        players, matrices = dataset.similarity(min_minutes=900)
+
+    s1, s2, s3 = st.columns(3)
+    with s1:
+        target = st.selectbox("Find players like:", list(zip(players["Player"], players["Squad"])), format_func=functions.player_label)
+    with s2:
+        template = st.selectbox("Compare on:", ["All Metrics"] + list(functions.TEMPLATES))
+    with s3:
+        top = st.number_input("Show top:", min_value=5, max_value=50, value=10, step=5, key="similar_top")
+
+    with timing.span("similar_players"):
+        similar = functions.similar_players(players, matrices, target, template=None if template == "All Metrics" else template, top=top)
+    st.dataframe(similar, hide_index=True, column_config={"Similarity": st.column_config.NumberColumn(format="%.1f%%")})
+
+
+### Timings
+spans = timing.finish_run("rerun")
+if debug:
+    with st.sidebar.expander("Timings", expanded=True):
+        # Spans are recorded as they finish; sorting on start time puts every stage after its parent.
+        breakdown = pd.DataFrame(spans).sort_values("time")
+        breakdown["Stage"] = ["\u2003" * depth + name for depth, name in zip(breakdown["depth"], breakdown["name"])]
+        st.dataframe(breakdown[["Stage","ms"]], hide_index=True)
+        st.caption("Cached stages don't run, so they only appear on the rerun that computed them.")
+        st.download_button("Download span log", timing.export(), file_name="spans.jsonl", mime="application/json")
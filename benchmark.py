@@ -0,0 +1,248 @@
+"""
+Benchmarks every stage of the data pipeline, from reading the workbooks to rendering radar charts, on the
+bundled data/ workbooks and on synthetic datasets scaled up from them.
+
+    python benchmark.py                               # bundled data, then 10x and 100x
+    python benchmark.py --scales 1 10 --repeats 5 --output before.json
+    python benchmark.py --compare before.json         # report the change against an earlier run
+
+Each stage reports its wall time (median and best of --repeats runs), its peak resident memory and the
+peak and net Python allocations traced while it runs. Results are written as JSON, along with the commit
+and library versions they were measured on, so runs from different versions can be compared.
+
+A synthetic dataset repeats every league's tables scale times: each copy is an extra season, with the
+players renamed and their stats jittered, so the pipeline sees scale times as many distinct players.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pandas as pd
+
+import functions
+
+
+def reset_peak_rss():
+    """
+    Resets the process' peak resident memory, where Linux allows it, so that it can be read per stage.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident memory since the last reset_peak_rss, or since the process started on
+    systems that don't allow resetting it.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(stage, scale, players, run, repeats):
+    """
+    Times a stage and measures its memory.\n
+
+    Args:
+        stage - Stage name.
+        scale, players - Dataset the stage runs on.
+        run - Callable running the stage once.
+        repeats - Number of timed runs.
+
+    Returns:
+        The result of the last run, and the stage's result record.
+    """
+    times = []
+    for _ in range(repeats):
+        reset_peak_rss()
+        start = time.perf_counter()
+        result = run()
+        times.append(time.perf_counter() - start)
+        rss = peak_rss_mb()
+
+    # Tracing slows allocations down, so it gets a run of its own outside the timings.
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    record = {"stage": stage, "scale": scale, "players": players, "repeats": repeats,
+              "wall_s_median": round(statistics.median(times), 6), "wall_s_min": round(min(times), 6),
+              "peak_rss_mb": round(rss, 1),
+              "alloc_peak_mb": round((peak - before) / 2**20, 2), "alloc_net_mb": round((current - before) / 2**20, 2)}
+    print(f"{stage:<22} x{scale:<4} {players or '-':>8} players  {record['wall_s_median']:>9.4f}s  "
+          f"rss {record['peak_rss_mb']:>8.1f} MB  alloc {record['alloc_peak_mb']:>8.2f} MB")
+    return result, record
+
+
+def synthetic_tables(tables, scale, seed=0):
+    """
+    Scales one league's tables up by repeating them.\n
+
+    Args:
+        tables - Dict of the std, poss, pas, ptype, misc and defe dataframes, as read by read_sheet.
+        scale - Number of copies.
+        seed - Seed of the stat jitter.
+
+    Returns:
+        The same dict, each table holding scale copies of its players. Copy i renames every player to
+        "{Player} ({i})", so the tables still join on (Player, Squad), and jitters their stats by up to 20%.
+    """
+    if scale == 1:
+        return tables
+    rng = np.random.default_rng(seed)
+    scaled = {}
+    for arg, table in tables.items():
+        stats = [column for column in table.columns if column not in functions.TEXT_COLUMNS]
+        copies = []
+        for copy in range(scale):
+            frame = table.copy()
+            if copy:
+                frame["Player"] = frame["Player"].astype(str) + f" ({copy})"
+                frame[stats] = frame[stats].mul(rng.uniform(0.8, 1.2, size=len(frame)), axis=0).astype("float32")
+            copies.append(frame)
+        scaled[arg] = pd.concat(copies, ignore_index=True)
+    return scaled
+
+
+def run_scale(scale, sheets, repeats, charts):
+    """
+    Benchmarks the stages that run on loaded sheets: merging, the derived tables and chart rendering.\n
+
+    Args:
+        scale - Number of copies of the bundled data.
+        sheets - The raw tables of every league, as returned by ingest_workbooks.
+        repeats - Number of timed runs per stage.
+        charts - Number of radar charts to render.
+
+    Returns:
+        The result records.
+    """
+    records = []
+    tables = {league: synthetic_tables(sheets[league, "raw"], scale, seed=index)
+              for index, league in enumerate(functions.season_leagues())}
+    players = sum(len(league_tables["std"]) for league_tables in tables.values())
+
+    def stage(name, run):
+        result, record = measure(name, scale, players, run, repeats)
+        records.append(record)
+        return result
+
+    merged = stage("merge_stats", lambda: {league: functions.merge_stats(league=functions.LEAGUES[league], **league_tables)
+                                           for league, league_tables in tables.items()})
+    data = stage("merge_leagues", lambda: functions.merge_leagues(**merged))
+    compact = stage("compact_frame", lambda: functions.compact_frame(data))
+    raw = stage("derive_metrics", lambda: functions.derive_metrics(compact))
+    dat = stage("per_90_frame", lambda: functions.derive_metrics(functions.per_90_frame(raw)))
+    stage("scatter_variables", lambda: functions.scatter_variables(dat))
+    stage("percentile_table", lambda: functions.percentile_table(dat))
+    stage("position_percentiles", lambda: functions.percentile_table(dat, by_position=True))
+    stage("leaderboard_index", lambda: functions.leaderboard_index(raw))
+    stage("minutes_table", lambda: functions.minutes_table(dat))
+    stage("similarity_index", lambda: functions.similarity_index(dat))
+    rdat = stage("radar_table", lambda: functions.radar_table(dat))
+    ranges = stage("metric_ranges", lambda: functions.metric_ranges(rdat))
+
+    if charts:
+        params = functions.TEMPLATES["Attacking Template"]
+        pairs = [(rdat.index[i], rdat.index[-1 - i]) for i in range(charts)]
+        stage("comparison_radar", lambda: [functions.figure_to_png(functions.comparison_radar(rdat[params], a, b, ranges))
+                                           for a, b in pairs])
+    return records
+
+
+def git_commit():
+    """
+    Returns the commit the benchmark runs on, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Prints the change in median wall time and peak allocations of every stage against an earlier run.
+    """
+    before = {(record["stage"], record["scale"]): record for record in baseline["results"]}
+    print(f"\nAgainst {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for record in results:
+        old = before.get((record["stage"], record["scale"]))
+        if old is None:
+            continue
+        ratio = record["wall_s_median"] / old["wall_s_median"] if old["wall_s_median"] else float("nan")
+        print(f"{record['stage']:<22} x{record['scale']:<4} {old['wall_s_median']:>9.4f}s -> "
+              f"{record['wall_s_median']:>9.4f}s ({ratio:.2f}x)  alloc {old['alloc_peak_mb']:.2f} -> "
+              f"{record['alloc_peak_mb']:.2f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's data pipeline.")
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100],
+                        help="Copies of the bundled data to benchmark on.")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per stage.")
+    parser.add_argument("--charts", type=int, default=5, help="Radar charts rendered per scale. 0 to skip.")
+    parser.add_argument("--skip-excel", action="store_true", help="Don't time parsing the xlsx workbooks.")
+    parser.add_argument("--output", default=None, help="Results file. Defaults to benchmarks/<timestamp>.json.")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against.")
+    args = parser.parse_args()
+
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    leagues = functions.season_leagues()
+    players = None
+    results = []
+
+    if not args.skip_excel:
+        # Parsing dominates a cold start, so it is timed once rather than repeated.
+        _, record = measure("read_excel", 1, players, lambda: [pd.read_excel(functions.workbook_path(league, table),
+                                                                             sheet_name=functions.SHEETS)
+                                                               for league in leagues
+                                                               for table in functions.TABLES.values()], 1)
+        results.append(record)
+
+    functions.refresh_cache()
+    sheets, record = measure("read_feather", 1, players, functions.ingest_workbooks, args.repeats)
+    record["players"] = sum(len(sheets[league, "raw"]["std"]) for league in leagues)
+    results.append(record)
+
+    for scale in args.scales:
+        results += run_scale(scale, sheets, args.repeats, args.charts)
+
+    report = {"timestamp": timestamp, "commit": git_commit(), "python": platform.python_version(),
+              "pandas": pd.__version__, "numpy": np.__version__, "machine": platform.machine(),
+              "cpus": os.cpu_count(), "results": results}
+    output = args.output or os.path.join("benchmarks", f"{timestamp}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Metric expressions: formulas over the dashboard's stat columns, compiled once and evaluated over whole
+columns at a time.
+
+An expression is plain arithmetic over column names, with column names that aren't a single word
+quoted in backticks, e.g.
+
+    `Non-Penalty Goals` + Assists
+    (`Key Passes` + `Through Balls`) / `Passes Attempted` * 100
+
+Numbers, + - * / ** and parentheses are allowed, as are the FUNCTIONS below; anything else, e.g.
+attribute access or a comparison, is rejected when the expression is compiled. A division by zero gives
+a missing value, as do missing inputs.
+"""
+import ast
+import json
+import os
+import re
+
+import numpy as np
+
+
+# Functions an expression can call, each applied elementwise. min and max ignore a missing argument.
+FUNCTIONS = {"abs": np.abs,
+             "sqrt": np.sqrt,
+             "log": np.log,
+             "min": np.fmin,
+             "max": np.fmax}
+# Number of arguments each of the FUNCTIONS takes.
+ARITY = {"abs": 1, "sqrt": 1, "log": 1, "min": 2, "max": 2}
+
+_QUOTED = re.compile(r"`([^`]+)`")
+_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+
+
+class Expression:
+    """
+    A compiled metric expression.\n
+
+    Args:
+        source - The expression, see the module docstring.
+        columns - Column names the expression may refer to.
+    """
+    def __init__(self, source, columns):
+        self.source = source
+        names = {}
+        # Columns are renamed to identifiers made of a prefix that appears nowhere in the source, so that no
+        # name written in the expression can alias one.
+        prefix = "_"
+        while prefix in source:
+            prefix += "_"
+
+        def name(match):
+            column = match.group(1)
+            names.setdefault(column, f"{prefix}{len(names)}")
+            return names[column]
+
+        try:
+            tree = ast.parse(_QUOTED.sub(name, source).strip(), mode="eval")
+        except SyntaxError as error:
+            raise ValueError(f"Invalid expression {source!r}: {error.msg}") from None
+
+        placeholders = set(names.values())
+        callees = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+                    raise ValueError(f"Invalid expression {source!r}: only {', '.join(FUNCTIONS)} can be called")
+                if len(node.args) != ARITY[node.func.id]:
+                    raise ValueError(f"Invalid expression {source!r}: {node.func.id} takes "
+                                     f"{ARITY[node.func.id]} argument{'s' if ARITY[node.func.id] > 1 else ''}")
+                callees.add(node.func)
+            elif isinstance(node, ast.Name):
+                # A bare word is a column, unless it is the function being called.
+                if node in callees or node.id in placeholders:
+                    continue
+                if node.id.startswith("_") or node.id in FUNCTIONS:
+                    raise ValueError(f"Invalid expression {source!r}: {node.id!r} isn't a column")
+                node.id = names.setdefault(node.id, f"{prefix}{len(names)}")
+            elif isinstance(node, ast.Constant):
+                if not isinstance(node.value, (int, float)) or isinstance(node.value, bool):
+                    raise ValueError(f"Invalid expression {source!r}: {node.value!r} isn't a number")
+            elif not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Load) + _OPERATORS):
+                raise ValueError(f"Invalid expression {source!r}: {type(node).__name__} isn't allowed")
+
+        unknown = [column for column in names if column not in columns]
+        if unknown:
+            raise ValueError(f"Invalid expression {source!r}: unknown column {unknown[0]!r}")
+        # Quoted columns were renamed before parsing and unquoted ones while walking, in order of appearance.
+        self.columns = list(names)
+        self._names = [names[column] for column in self.columns]
+        self._code = compile(ast.fix_missing_locations(tree), f"<metric {source!r}>", "eval")
+
+    def __call__(self, values):
+        """
+        Evaluates the expression.\n
+
+        Args:
+            values - Mapping of column name -> array, holding at least every column in self.columns.
+
+        Returns:
+            A float32 array, with missing values where the expression isn't defined.
+        """
+        arrays = {identifier: values[column] for identifier, column in zip(self._names, self.columns)}
+        size = len(next(iter(arrays.values()))) if arrays else len(next(iter(values.values())))
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            result = eval(self._code, {"__builtins__": {}, **FUNCTIONS}, arrays)
+        result = np.array(np.broadcast_to(result, size), dtype="float32")
+        result[~np.isfinite(result)] = np.nan
+        return result
+
+    def __repr__(self):
+        return f"Expression({self.source!r})"
+
+
+def compile_metrics(definitions, columns):
+    """
+    Compiles metric definitions. A metric may refer to the given columns and to the metrics defined
+    before it.\n
+
+    Args:
+        definitions - Dict of metric name -> expression, in evaluation order.
+        columns - Column names the expressions may refer to.
+
+    Returns:
+        A dict of metric name -> Expression, in the same order.
+    """
+    known = list(columns)
+    metrics = {}
+    for name, source in definitions.items():
+        try:
+            metrics[name] = Expression(source, known)
+        except ValueError as error:
+            raise ValueError(f"Metric {name!r}: {error}") from None
+        known.append(name)
+    return metrics
+
+
+def read_definitions(path):
+    """
+    Reads user-defined metrics and radar templates from a JSON file of the form
+    {"metrics": {name: expression, ...}, "templates": {name: [metric, ...], ...}}.\n
+
+    Args:
+        path - The JSON file. Both keys are optional, as is the file itself.
+
+    Returns:
+        The "metrics" and "templates" dicts.
+    """
+    if not os.path.exists(path):
+        return {}, {}
+    with open(path) as file:
+        definitions = json.load(file)
+    return dict(definitions.get("metrics", {})), dict(definitions.get("templates", {}))
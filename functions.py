@@ -1,9 +1,412 @@
+import io
+import os
+import collections
+import glob
+import json
+import shutil
+from datetime import datetime
+import hashlib
+import subprocess
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-import streamlit as st
+import pyarrow.feather as feather
 import matplotlib.pyplot as plt
 import soccerplots
 from soccerplots.radar_chart import Radar
 
+import expressions
+import timing
+
+
+DATA_DIR = "data"
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+# Frames published for every process on the machine to memory-map, see publish_frame.
+SHARED_DIR = os.path.join(CACHE_DIR, "shared")
+# Bump when tidy_sheet, compact_frame or per_90_frame changes, so existing Feather copies and shared frames
+# are rebuilt.
+CACHE_VERSION = 4
+
+# Workbook sheets that are read. Every workbook also has a "per_90" sheet, which isn't: per_90_frame
+# derives the same stats from the raw ones. So the "sheet" argument of cache_path, read_sheet and
+# load_league is always "raw" for now; it is kept so that another sheet can be read by adding it here.
+SHEETS = ["raw"]
+
+# Season -> directory holding its workbooks. The data is partitioned by (season, league, table): one
+# workbook, and one pair of Feather copies, per partition. A new season goes in its own subdirectory,
+# e.g. "24/25": os.path.join(DATA_DIR, "24-25"), and is only read once it is selected.
+SEASONS = {"23/24": DATA_DIR}
+CURRENT_SEASON = "23/24"
+
+# League prefixes used in the workbook file names, e.g. "data/pl_passing.xlsx", in the order the
+# leagues are merged.
+LEAGUES = {"pl":"Premier League",
+           "li":"Ligue 1",
+           "ll":"La Liga",
+           "sa":"Serie A",
+           "bl":"Bundesliga",
+           }
+
+# merge_stats argument -> workbook table name.
+TABLES = {"std":"standard",
+          "poss":"possession",
+          "pas":"passing",
+          "ptype":"pass_types",
+          "misc":"misc",
+          "defe":"defensive_actions"}
+
+# Columns that hold text; every other column is a stat.
+TEXT_COLUMNS = ["Player","Nation","Pos","Squad","Age","Matches"]
+
+# Column schema of every workbook table: FBref header -> dashboard name. Only the columns listed here are
+# read from the Feather copies, everything else in the workbooks is never loaded. Stats are stored as
+# float32 and CATEGORY_COLUMNS as categoricals.
+SCHEMA = {"standard":{"Player":"Player","Nation":"Nation","Pos":"Pos","Squad":"Squad","Age":"Age","MP":"MP","Starts":"Starts",
+                      "Min":"Minutes Played","90s":"90s","Gls":"Goals Scored","Ast":"Assists","G+A":"Goals + Assists",
+                      "G-PK":"Non-Penalty Goals","PK":"Penalties Scored","PKatt":"Penalties Attempted","CrdY":"Yellow Cards",
+                      "CrdR":"Red Cards","xG":"Expected Goals","npxG":"Non-Penalty Expected Goals","xAG":"Expected Assists",
+                      "PrgC":"Progressive Carries","PrgP":"Progressive Passes","PrgR":"Progressive Passes Received"},
+          "possession":{"Player":"Player","Squad":"Squad","Touches":"Touches","Def Pen":"Touches in the Defensive Penalty Area",
+                        "Def 3rd":"Defensive 1/3 Touches","Mid 3rd":"Middle 1/3 Touches","Att 3rd":"Touches in the Attacking Third",
+                        "Att Pen":"Attacking Penalty Area Touches","Att":"Dribbles Attempted","Succ%":"Dribble Success %",
+                        "Carries":"Carries","TotDist":"Total Carry Distance","PrgDist":"Progressive Carrying Distance","PrgC":"PrgC",
+                        "CPA":"Carries into the Penalty Area","Rec":"Passes Received"},
+          "passing":{"Player":"Player","Squad":"Squad","Att":"Passes Attempted","Cmp%":"Pass Completion %","TotDist":"TotDist",
+                     "PrgDist":"Progressive Passing Distance","Cmp.1":"Short Passes Completed","Att.1":"Short Passes Attempted",
+                     "Cmp%.1":"Short Pass Completion %","Cmp.2":"Medium Passes Completed","Att.2":"Medium Passes Attempted",
+                     "Cmp%.2":"Medium Pass Completion %","Cmp.3":"Long Passes Completed","Att.3":"Long Passes Attempted",
+                     "Cmp%.3":"Long Pass Completion %","A-xAG":"xA Overperformance","KP":"Key Passes",
+                     "PPA":"Passes into the Penalty Area","CrsPA":"Crosses into the Penalty Area"},
+          "pass_types":{"Player":"Player","Squad":"Squad","Live":"Live Ball Passes","Dead":"Dead Ball Passes","TB":"Through Balls",
+                        "Sw":"Switches","Crs":"Crosses","CK":"Corner Kicks"},
+          "misc":{"Player":"Player","Squad":"Squad","Fls":"Fouls","Fld":"Fouls Drawn","PKwon":"Penalty Kicks Won","PKcon":"PKcon",
+                  "Recov":"Recoveries","Won":"Won","Won%":"Aerial Duel Success Rate"},
+          "defensive_actions":{"Player":"Player","Squad":"Squad","Tkl":"Tackles","TklW":"Tackles Won","Def 3rd":"Defensive 3rd Tackles",
+                               "Mid 3rd":"Middle 3rd Tackles","Att 3rd":"Attacking 3rd Tackles","Int":"Interceptions",
+                               "Tkl+Int":"Tackles + Interceptions","Clr":"Clearances","Err":"Errors Leading to a Shot"}}
+
+CATEGORY_COLUMNS = ["League","Squad","Pos","Nation"]
+
+# Text columns that compact_frame dictionary-encodes.
+ENCODED_COLUMNS = ["Player","Nation","Pos","Squad","Age","League"]
+
+# Stats that per_90_frame leaves as they are: playing time, and rates that don't grow with minutes.
+PLAYING_TIME_COLUMNS = ["MP","Starts","Minutes Played","90s"]
+RATE_COLUMNS = ["Dribble Success %","Pass Completion %","Short Pass Completion %","Medium Pass Completion %",
+                "Long Pass Completion %","Aerial Duel Success Rate","Tackle Success Rate"]
+
+# Position groups percentiles can be ranked within. A player listed at several positions, e.g. "MF,FW",
+# belongs to the first one.
+POSITION_GROUPS = ["GK","DF","MF","FW"]
+
+# Player pools: minutes thresholds are rounded down to the minutes slider's step and capped, so that only a
+# bounded number of pools is ever ranked. A Dataset keeps the tables of the POOL_CACHE_SIZE most recently
+# used pools, and at most PERCENTILE_TABLES percentile tables are published per league scope.
+MINUTES_STEP = 100
+MAX_MINUTES = 3500
+POOL_CACHE_SIZE = 16
+PERCENTILE_TABLES = 16
+
+# Radar chart templates: the scatter_variables columns plotted on each.
+TEMPLATES = {"Attacking Template":["Goals Scored","Assists","Dribbles Attempted","Dribble Success %","Key Passes","Crosses into the Penalty Area",
+                                  "Passes into the Penalty Area","Expected Goals","Expected Assists","xA Overperformance"],
+             "Possession Template":["Pass Completion %","Progressive Passes","Carries","Progressive Carries","Progressive Carrying Distance",
+                                   "Progressive Passing Distance","Through Balls","Touches","Progressive Passes Received","Key Passes"],
+             "Defensive Template":["Recoveries","Tackles","Tackles Won","Tackle Success Rate","Interceptions","Clearances","Errors Leading to a Shot",
+                                  "Fouls","Aerial Duel Success Rate"]}
+
+# Stats plotted on the scatterplots and radar charts, see scatter_variables.
+SCATTER_COLUMNS = ["Goals Scored","Assists","Goals + Assists","Non-Penalty Goals","Penalties Scored",
+                   "Penalties Attempted","Yellow Cards","Red Cards","Expected Goals","Non-Penalty Expected Goals",
+                   "Expected Assists","Progressive Carries","Progressive Passes","Progressive Passes Received",
+                   "Touches","Touches in the Defensive Penalty Area","Defensive 1/3 Touches","Middle 1/3 Touches",
+                   "Touches in the Attacking Third","Attacking Penalty Area Touches","Dribbles Attempted",
+                   "Dribble Success %","Carries","Total Carry Distance","Progressive Carrying Distance","PrgC",
+                   "Carries into the Penalty Area","Passes Received","Passes Attempted","Pass Completion %","TotDist",
+                   "Progressive Passing Distance","Short Passes Completed","Short Passes Attempted",
+                   "Short Pass Completion %","Medium Passes Completed","Medium Passes Attempted",
+                   "Medium Pass Completion %","Long Passes Completed","Long Passes Attempted","Long Pass Completion %",
+                   "xA Overperformance","Key Passes","Passes into the Penalty Area","Crosses into the Penalty Area",
+                   "Live Ball Passes","Dead Ball Passes","Through Balls","Switches","Crosses","Corner Kicks","Fouls",
+                   "Fouls Drawn","Penalty Kicks Won","PKcon","Recoveries","Won","Aerial Duel Success Rate","Tackles",
+                   "Tackles Won","Defensive 3rd Tackles","Middle 3rd Tackles","Attacking 3rd Tackles","Interceptions",
+                   "Tackles + Interceptions","Clearances","Errors Leading to a Shot","Tackle Success Rate"]
+
+# Stats derived from other stats, as expressions.py formulas over the SCHEMA stats, evaluated by
+# derive_metrics. Analysts add their own metrics, and radar templates using them, to METRICS_PATH, e.g.
+#   {"metrics": {"Non-Penalty Goals + Assists": "`Non-Penalty Goals` + Assists"},
+#    "templates": {"Scoring Template": ["Non-Penalty Goals + Assists", ...]}}
+# Every metric is compiled once, when this module is imported, and shows up wherever the scatter_variables
+# do; a metric may use the ones defined before it.
+DERIVED_METRICS = {"Tackle Success Rate":"`Tackles Won` / Tackles * 100"}
+METRICS_PATH = "metrics.json"
+STAT_COLUMNS = list(dict.fromkeys(name for table in SCHEMA.values() for name in table.values() if name not in ENCODED_COLUMNS))
+_user_metrics, _user_templates = expressions.read_definitions(METRICS_PATH)
+METRICS = expressions.compile_metrics({**DERIVED_METRICS, **_user_metrics}, STAT_COLUMNS)
+for _template, _params in _user_templates.items():
+    for _param in _params:
+        if _param not in SCATTER_COLUMNS and _param not in METRICS:
+            raise ValueError(f"Template {_template!r}: unknown metric {_param!r}")
+TEMPLATES.update(_user_templates)
+# Changes with the metric definitions, so that frames derived with other definitions aren't reused.
+METRICS_VERSION = hashlib.sha1(json.dumps({name: metric.source for name, metric in METRICS.items()}).encode()).hexdigest()[:8]
+
+# Workbooks that don't follow the "{league}_{table}.xlsx" naming.
+WORKBOOK_OVERRIDES = {("sa","possession"):"sa_posession.xlsx"}
+
+
+def workbook_path(league, table, season=CURRENT_SEASON):
+    """
+    Builds the path to a league's stats workbook.\n
+
+    Args:
+        league - League prefix, e.g. "pl".
+        table - Table name, e.g. "passing".
+        season - Season, a SEASONS key.
+
+    Returns:
+        Path to the xlsx file.
+    """
+    name = WORKBOOK_OVERRIDES.get((league, table), f"{league}_{table}.xlsx")
+    return os.path.join(SEASONS[season], name)
+
+
+def cache_path(league, table, sheet, season=CURRENT_SEASON):
+    """
+    Builds the path to the Feather copy of a workbook sheet.\n
+
+    Args:
+        league - League prefix, e.g. "pl".
+        table - Table name, e.g. "passing".
+        sheet - Workbook sheet, one of SHEETS, i.e. currently always "raw".
+        season - Season, a SEASONS key.
+
+    Returns:
+        Path to the feather file inside CACHE_DIR.
+    """
+    return os.path.join(CACHE_DIR, f"{season.replace('/', '-')}_{league}_{table}_{sheet}_v{CACHE_VERSION}.feather")
+
+
+def season_leagues(season=CURRENT_SEASON):
+    """
+    Lists the leagues a season has data for, i.e. whose workbooks are all present.\n
+
+    Args:
+        season - Season, a SEASONS key.
+
+    Returns:
+        League prefixes, in LEAGUES order.
+    """
+    return [league for league in LEAGUES
+            if all(os.path.exists(workbook_path(league, table, season)) for table in TABLES.values())]
+
+
+def tidy_sheet(df):
+    """
+    Prepares a freshly read sheet for columnar storage. FBref exports repeat the header row every
+    few players, which leaves strings inside numeric columns, and Excel turns a few headers
+    (e.g. "1/3") into dates.\n
+
+    Args:
+        df - A sheet as returned by pd.read_excel.
+
+    Returns:
+        The sheet without repeated header rows, with string column names and numeric stat columns.
+    """
+    df = df[df["Player"] != "Player"].reset_index(drop=True)
+    df.columns = [f"{column.day}/{column.month}" if isinstance(column, datetime) else str(column) for column in df.columns]
+    for column in df.columns:
+        if column not in TEXT_COLUMNS and df[column].dtype == object:
+            df[column] = pd.to_numeric(df[column], errors="coerce")
+    return df
+
+
+def cache_is_stale(league, table, season=CURRENT_SEASON):
+    """
+    Checks whether a workbook's Feather copies are missing or older than the workbook.\n
+
+    Args:
+        league - League prefix, e.g. "pl".
+        table - Table name, e.g. "passing".
+        season - Season, a SEASONS key.
+
+    Returns:
+        True if the workbook needs to be parsed again.
+    """
+    source = os.path.getmtime(workbook_path(league, table, season))
+    for sheet in SHEETS:
+        path = cache_path(league, table, sheet, season)
+        if not os.path.exists(path) or os.path.getmtime(path) < source:
+            return True
+    return False
+
+
+@timing.timed
+def build_cache(league, table, season=CURRENT_SEASON):
+    """
+    Parses a workbook once, reading every sheet in SHEETS, and stores each sheet as an uncompressed
+    Feather file, which can later be memory-mapped instead of parsed. The workbook's other Feather copies
+    are removed.\n
+
+    Args:
+        league - League prefix, e.g. "pl".
+        table - Table name, e.g. "passing".
+        season - Season, a SEASONS key.
+    """
+    sheets = pd.read_excel(workbook_path(league, table, season), sheet_name=SHEETS)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for sheet, df in sheets.items():
+        path = cache_path(league, table, sheet, season)
+        # Write then rename, so a concurrent reader never maps a half-written file.
+        feather.write_feather(tidy_sheet(df), path + ".tmp", compression="uncompressed")
+        os.replace(path + ".tmp", path)
+    # Copies of other CACHE_VERSIONs, or of sheets no longer read, are never read again.
+    current = [cache_path(league, table, sheet, season) for sheet in SHEETS]
+    for older in glob.glob(os.path.join(CACHE_DIR, f"{season.replace('/', '-')}_{league}_{table}_*_v*.feather")):
+        if older not in current:
+            try:
+                os.remove(older)
+            except OSError:
+                pass
+
+
+@timing.timed
+def read_sheet(league, table, sheet, season=CURRENT_SEASON):
+    """
+    Reads a workbook sheet from its Feather copy, rebuilding the copy first if it is missing or
+    older than the workbook.\n
+
+    Args:
+        league - League prefix, e.g. "pl".
+        table - Table name, e.g. "passing".
+        sheet - Workbook sheet, one of SHEETS, i.e. currently always "raw".
+        season - Season, a SEASONS key.
+
+    Returns:
+        The sheet as a dataframe, holding only the columns in its SCHEMA entry.
+    """
+    if cache_is_stale(league, table, season):
+        build_cache(league, table, season)
+    path = cache_path(league, table, sheet, season)
+    return feather.read_table(path, columns=list(SCHEMA[table]), memory_map=True).to_pandas()
+
+
+def build_caches(partitions, max_workers=None):
+    """
+    Runs build_cache for several workbooks in parallel, across a process pool.\n
+
+    Args:
+        partitions - (league prefix, table, season) of each workbook.
+        max_workers - Number of worker processes. Defaults to the number of CPUs.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        list(pool.map(build_cache, *zip(*partitions)))
+
+
+@timing.timed
+def refresh_cache(max_workers=None, season=CURRENT_SEASON, leagues=None):
+    """
+    Brings a season's Feather copies up to date, parsing the stale workbooks in parallel with
+    build_caches, from a child interpreter.\n
+
+    Args:
+        max_workers - Number of worker processes. Defaults to the number of CPUs.
+        season - Season, a SEASONS key.
+        leagues - League prefixes to refresh. Defaults to every league of the season.
+
+    Returns:
+        The (league prefix, table, season) partitions that were rebuilt.
+    """
+    stale = [(league, table, season) for league in leagues or season_leagues(season) for table in TABLES.values()
+             if cache_is_stale(league, table, season)]
+    if len(stale) > 1:
+        # The pool is started from a fresh interpreter. This runs inside threaded servers, e.g. Streamlit's,
+        # where forking while another thread holds a lock can deadlock the child, and the other start methods
+        # re-import the caller's __main__, e.g. app.py, in every worker.
+        script = "import json, sys, functions; functions.build_caches(json.loads(sys.argv[1]), json.loads(sys.argv[2]))"
+        path = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get("PYTHONPATH")]))
+        subprocess.run([sys.executable, "-c", script, json.dumps(stale), json.dumps(max_workers)],
+                       env={**os.environ, "PYTHONPATH": path}, check=True)
+    elif stale:
+        build_cache(*stale[0])
+    return stale
+
+
+def ingest_workbooks(max_workers=None, season=CURRENT_SEASON, leagues=None):
+    """
+    Brings a season's Feather copies up to date with refresh_cache and reads all of them.\n
+
+    Args:
+        max_workers - Number of worker processes. Defaults to the number of CPUs.
+        season - Season, a SEASONS key.
+        leagues - League prefixes to read. Defaults to every league of the season.
+
+    Returns:
+        A dict keyed by (league prefix, sheet) of dicts holding the std, poss, pas, ptype, misc and
+        defe dataframes, ready to be passed to merge_stats.
+    """
+    leagues = leagues or season_leagues(season)
+    refresh_cache(max_workers=max_workers, season=season, leagues=leagues)
+
+    sheets = {}
+    for league in leagues:
+        for sheet in SHEETS:
+            sheets[league, sheet] = {arg: read_sheet(league, table, sheet, season) for arg, table in TABLES.items()}
+    return sheets
+
+
+def data_fingerprint(leagues=None, season=CURRENT_SEASON):
+    """
+    Fingerprints the source workbooks by modification time and size, so that an updated workbook
+    produces a different value and invalidates anything cached on it.\n
+
+    Args:
+        leagues - League prefixes to fingerprint. Defaults to every league of the season.
+        season - Season, a SEASONS key.
+
+    Returns:
+        A hashable tuple of (path, mtime, size) for every workbook of those leagues.
+    """
+    fingerprint = []
+    for league in leagues or season_leagues(season):
+        for table in TABLES.values():
+            path = workbook_path(league, table, season)
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+
+def dataset_version(leagues=None, season=CURRENT_SEASON):
+    """
+    Short identifier of the current state of the source workbooks, used to name files derived from them.\n
+
+    Args:
+        leagues - League prefixes the derived file depends on. Defaults to every league of the season.
+        season - Season, a SEASONS key.
+
+    Returns:
+        A 12 character hex string that changes whenever data_fingerprint does.
+    """
+    return hashlib.sha1(repr(data_fingerprint(leagues, season)).encode()).hexdigest()[:12]
+
+
+def apply_schema(df, table):
+    """
+    Selects, renames and types a table's columns as declared in SCHEMA.\n
+
+    Args:
+        df - The table, as read from its workbook.
+        table - Table name, e.g. "passing".
+
+    Returns:
+        The table with dashboard column names, stats stored as float32.
+    """
+    schema = SCHEMA[table]
+    df = df[list(schema)].rename(columns=schema)
+    stats = [column for column in df.columns if column not in TEXT_COLUMNS]
+    return df.astype(dict.fromkeys(stats, "float32"))
 
 
 def clean_standard(std):
@@ -16,10 +419,7 @@ def clean_standard(std):
     Returns:
         Renamed Standard Stats data.
     """
-    std.rename(columns={"Gls":"Goals Scored", "Ast":"Assists","G+A":"Goals + Assists","Min":"Minutes Played", "xG":"Expected Goals","xAG":"Expected Assists","PK":"Penalties Scored","PKatt":"Penalties Attempted","CrdY":"Yellow Cards", "CrdR":"Red Cards",
-                         "PrgC":"Progressive Carries","PrgP":"Progressive Passes","PrgR":"Progressive Passes Received", "G-PK":"Non-Penalty Goals",
-                          "npxG":"Non-Penalty Expected Goals", }, inplace=True)
-    return std
+    return apply_schema(std, "standard")
 
 def clean_poss(poss):
     """
@@ -31,12 +431,7 @@ def clean_poss(poss):
     Returns:
         Cleaned Possesion data.
     """
-    poss.rename(columns={"Att 3rd":"Touches in the Attacking Third", "TotDist":"Total Carry Distance","Att":"Dribbles Attempted", "Succ%":"Dribble Success %",
-                         "1/3":"Carries Into the Final Third", "CPA":"Carries into the Penalty Area","Rec":"Passes Received",
-                         "PrgR":"Progressive Passes Received","Def Pen":"Touches in the Defensive Penalty Area",
-                         "Def 3rd":"Defensive 1/3 Touches","Mid 3rd":"Middle 1/3 Touches","Att Pen":"Attacking Penalty Area Touches",},inplace=True)
-    poss.drop(columns=["Pos","Age","Born","90s","Nation","Matches"], inplace=True)
-    return poss
+    return apply_schema(poss, "possession")
 
 def clean_pass(pas):
     """
@@ -48,11 +443,7 @@ def clean_pass(pas):
     Returns:
         Cleaned Passing data.
     """
-    pas.rename(columns={"KP":"Key Passes","CrsPA":"Crosses into the Penalty Area","PPA":"Passes into the Penalty Area",
-                        "A-xAG":"xA Overperformance","Att":"Passes Attempted",
-                        "Cmp%":"Pass Completion %"},inplace=True)
-    pas.drop(columns=["Pos","Age","Born","90s","Nation","Matches"], inplace=True)
-    return pas
+    return apply_schema(pas, "passing")
 
 def clean_ptypes(ptype):
     """
@@ -64,9 +455,7 @@ def clean_ptypes(ptype):
     Returns:
         Cleaned Pass Types data.
     """
-    ptype.rename(columns={"Sw":"Switches"},inplace=True)
-    ptype.drop(columns=["Pos","Age","Born","90s","Nation","Att","Matches"], inplace=True)
-    return ptype
+    return apply_schema(ptype, "pass_types")
 
 def clean_misc(misc):
     """
@@ -78,13 +467,12 @@ def clean_misc(misc):
     Returns:
         Cleaned Miscellanous data.
     """
-    misc.rename(columns={"Recov":"Recoveries","Won%":"Aerial Duel Success Rate","Fls":"Fouls", "'Int":"Interceptions", "Fld":"Fouls Drawn","PKwon":"Penalty Kicks Won"}, inplace=True)
-    misc.drop(columns=["Pos","Age","Born","90s","Nation","Matches"], inplace=True)
-    return misc
+    return apply_schema(misc, "misc")
     
 def clean_def_actions(defe):
     """
-    Cleans "defensive actions" data, renaming columns, dropping a few and generating a new feature.\n
+    Cleans "defensive actions" data, renaming columns and dropping a few. Tackle Success Rate is one of the
+    DERIVED_METRICS, added once the leagues are merged.\n
 
     Args:
         Defensive Actions data. \n
@@ -92,12 +480,11 @@ def clean_def_actions(defe):
     Returns:
         Cleaned Defensive Actions data.
     """
-    defe.rename(columns={"Tkl":"Tackles"},inplace=True)
-    defe.drop(columns=["Pos","Age","Born","90s","Nation","Matches"], inplace=True)
-    defe['Tackle Success Rate'] = (defe['TklW']/defe["Tackles"]) * 100
+    defe = apply_schema(defe, "defensive_actions")
     return defe
 
 
+@timing.timed
 def merge_stats(league, std, poss, pas, ptype, misc, defe):
     """
     Combines the standard stats, possession, passing, pass types, miscellanous and defensive actions data, merging them into 
@@ -118,29 +505,402 @@ def merge_stats(league, std, poss, pas, ptype, misc, defe):
     misc = clean_misc(misc)
     defe = clean_def_actions(defe)
 
-    data = std.merge(poss, on=["Player","Squad"], how="left")
-    data = data.merge(pas, on=["Player", "Squad"], how="left")
-    data = data.merge(ptype, on=["Player","Squad"], how="left")
-    data = data.merge(misc, on=["Player","Squad"], how="left")
-    data = data.merge(defe, on=["Player", "Squad"], how="left")
+    # Every table is aligned on the standard stats' (Player, Squad) keys and joined in a single concat.
+    # A column already taken from an earlier table holds the same stat, so later copies are dropped
+    # instead of being suffixed with _x/_y.
+    keys = pd.MultiIndex.from_frame(std[["Player","Squad"]])
+    parts = [std]
+    seen = set(std.columns)
+    for table in [poss, pas, ptype, misc, defe]:
+        table = table.set_index(["Player","Squad"])
+        table = table.loc[~table.index.duplicated(), ~table.columns.isin(seen)]
+        seen.update(table.columns)
+        table = table.reindex(keys)
+        table.index = std.index
+        parts.append(table)
+    data = pd.concat(parts, axis=1)
     data["League"] = league
     return data
 
 
-def merge_leagues(pl,li,ll,sa):
+def load_league(league, sheet, season=CURRENT_SEASON):
+    """
+    Reads one league's six stats tables from a sheet type and merges them.\n
+
+    Args:
+        league - League prefix, e.g. "pl".
+        sheet - Workbook sheet, one of SHEETS, i.e. currently always "raw".
+        season - Season, a SEASONS key.
+
+    Returns:
+        The merged league dataframe, as returned by merge_stats.
+    """
+    tables = {arg: read_sheet(league, table, sheet, season) for arg, table in TABLES.items()}
+    return merge_stats(league=LEAGUES[league], **tables)
+
+
+@timing.timed
+def merge_leagues(**leagues):
     """
     Merges dataframes from different leagues.\n
 
     Args:
-        pl,li,ll,sa = Premier League, Liggue 1, La Liga, Serie A dataframes.\n
+        leagues - League dataframes keyed by league prefix, e.g. pl=..., li=....\n
 
     Returns:
-        A unified dataframe with all leagues.
+        A unified dataframe with all leagues, with CATEGORY_COLUMNS as categoricals.
     """
-    data = pd.concat([pl,li,ll,sa], axis=0)
-    print(data["League"].unique())
+    data = pd.concat(list(leagues.values()), axis=0)
+    # Categoricals are set after the concat: leagues have different squads, and concatenating
+    # categoricals with different categories falls back to object.
+    data = data.astype(dict.fromkeys(CATEGORY_COLUMNS, "category"))
     return data
 
+@timing.timed
+def compact_frame(data):
+    """
+    Packs a merged dataframe into a compact, read-only layout: text columns are dictionary-encoded as
+    categoricals and every stat lives in one contiguous float32 block, so the frame can be shared
+    between sessions instead of copied.\n
+
+    Args:
+        data - A dataframe as returned by merge_leagues.
+
+    Returns:
+        The same columns, in the same order, backed by a read-only float32 matrix.
+    """
+    text = [column for column in data.columns if column in ENCODED_COLUMNS]
+    stats = [column for column in data.columns if column not in ENCODED_COLUMNS]
+
+    # pandas stores a block column-major, so each stat is one contiguous row of the matrix.
+    matrix = np.ascontiguousarray(data[stats].to_numpy(dtype="float32").T)
+    matrix.flags.writeable = False
+    compact = pd.DataFrame(matrix.T, columns=stats, copy=False)
+    for column in text:
+        values = data[column].astype(object)
+        if column == "Age":
+            # Age is read as an int, a float or "yy-ddd" text depending on the league; only the years are kept,
+            # so that every league shares the same categories.
+            values = values.astype(str).str.extract(r"^(\d+)", expand=False)
+        else:
+            values = values.where(values.isna(), values.astype(str))
+        compact.insert(data.columns.get_loc(column), column, pd.Categorical(values))
+    return compact
+
+
+@timing.timed
+def per_90_frame(data):
+    """
+    Derives per 90 stats from raw ones, dividing every count by the player's "90s" in a single pass over
+    the stats matrix. Playing time and RATE_COLUMNS are kept as they are, as are the stats of players
+    whose "90s" is 0 or missing; any other player is divided, even one with only a fraction of a 90.\n
+
+    Args:
+        data - Raw stats, as returned by compact_frame.
+
+    Returns:
+        A compact frame with the same columns, text columns shared with data.
+    """
+    stats = [column for column in data.columns if column not in ENCODED_COLUMNS]
+    # METRICS are left as they are too, derive_metrics recomputes them from the per 90 stats.
+    counts = [position for position, column in enumerate(stats)
+              if column not in PLAYING_TIME_COLUMNS + RATE_COLUMNS and column not in METRICS]
+
+    matrix = np.ascontiguousarray(data[stats].to_numpy(dtype="float32").T)
+    nineties = data["90s"].to_numpy(dtype="float32")
+    matrix[counts] /= np.where(nineties > 0, nineties, 1)
+    matrix.flags.writeable = False
+
+    per_90 = pd.DataFrame(matrix.T, columns=stats, copy=False)
+    for column in data.columns:
+        if column in ENCODED_COLUMNS:
+            per_90.insert(data.columns.get_loc(column), column, data[column].array)
+    return per_90
+
+
+@timing.timed
+def derive_metrics(data):
+    """
+    Evaluates every METRICS expression over a frame's stats, in one pass over its stats matrix. Each frame
+    gets its metrics from its own stats, so on the per 90 frame a sum of counts is per 90 and a ratio of
+    counts is the same rate as on the raw frame.\n
+
+    Args:
+        data - A compact frame, as returned by compact_frame or per_90_frame.
+
+    Returns:
+        A compact frame with the same columns, the metrics recomputed, and the metrics data didn't have
+        added at the end.
+    """
+    stats = [column for column in data.columns if column not in ENCODED_COLUMNS]
+    columns = stats + [name for name in METRICS if name not in stats]
+    matrix = np.empty((len(columns), len(data)), dtype="float32")
+    matrix[:len(stats)] = data[stats].to_numpy(dtype="float32").T
+    rows = dict(zip(columns, matrix))
+    for name, metric in METRICS.items():
+        rows[name][:] = metric(rows)
+    matrix.flags.writeable = False
+
+    derived = pd.DataFrame(matrix.T, columns=columns, copy=False)
+    for column in data.columns:
+        if column in ENCODED_COLUMNS:
+            derived.insert(data.columns.get_loc(column), column, data[column].array)
+    return derived
+
+
+def publish_frame(frame, path):
+    """
+    Writes a compact frame as raw arrays that any process can memory-map with attach_frame: the stats
+    matrix, one row per stat, and the category codes of the text columns, plus a JSON manifest. Every
+    process attached to it shares the same physical pages, through the OS page cache. The directory is
+    written under a temporary name and renamed, so a reader never sees a partial frame.\n
+
+    Args:
+        frame - A frame from compact_frame or per_90_frame, or a float32 table with a text index, like
+                percentile_table's.
+        path - Directory to write.
+    """
+    index = [name for name in frame.index.names if name is not None]
+    flat = frame.reset_index() if index else frame
+    text = [column for column in flat.columns if not pd.api.types.is_float_dtype(flat[column])]
+    stats = [column for column in flat.columns if column not in text]
+
+    categoricals = [pd.Categorical(flat[column]) for column in text]
+    manifest = {"columns": list(flat.columns), "index": index, "stats": stats,
+                "text": {column: categorical.categories.tolist() for column, categorical in zip(text, categoricals)}}
+
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(temporary)
+    try:
+        np.save(os.path.join(temporary, "stats.npy"), np.ascontiguousarray(flat[stats].to_numpy(dtype="float32").T))
+        codes = np.stack([categorical.codes.astype("int32") for categorical in categoricals]) if text else np.empty((0, len(flat)), "int32")
+        np.save(os.path.join(temporary, "codes.npy"), codes)
+        with open(os.path.join(temporary, "manifest.json"), "w") as file:
+            json.dump(manifest, file)
+    except OSError:
+        # e.g. a full disk: nothing is left behind, and the caller keeps the frame it has.
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+    try:
+        os.replace(temporary, path)
+    except OSError:
+        # Another process published the same frame first.
+        shutil.rmtree(temporary, ignore_errors=True)
+
+
+def attach_frame(path):
+    """
+    Maps a frame written by publish_frame, without reading or copying its stats.\n
+
+    Args:
+        path - Directory written by publish_frame.
+
+    Returns:
+        The frame, its stats backed by a read-only memory map, or None if nothing is published at path.
+    """
+    # Another process may remove a superseded version at any point, even between these reads.
+    try:
+        with open(os.path.join(path, "manifest.json")) as file:
+            manifest = json.load(file)
+        matrix = np.load(os.path.join(path, "stats.npy"), mmap_mode="r")
+        codes = np.load(os.path.join(path, "codes.npy"), mmap_mode="r")
+    except OSError:
+        return None
+    text = {column: pd.Categorical.from_codes(codes[i], categories=categories)
+            for i, (column, categories) in enumerate(manifest["text"].items())}
+
+    index = None
+    if manifest["index"]:
+        index = pd.MultiIndex.from_arrays([text[name] for name in manifest["index"]], names=manifest["index"])
+    frame = pd.DataFrame(matrix.T, columns=manifest["stats"], index=index, copy=False)
+    columns = [column for column in manifest["columns"] if column not in manifest["index"]]
+    for column in columns:
+        if column in text:
+            frame.insert(columns.index(column), column, text[column])
+    return frame
+
+
+def shared_path(name, season=CURRENT_SEASON):
+    """
+    Path at which a frame derived from a season's workbooks is published, for their current state.
+    """
+    return os.path.join(SHARED_DIR, f"{season.replace('/', '-')}_{name}_v{CACHE_VERSION}_{METRICS_VERSION}_{dataset_version(season=season)}")
+
+
+def shared_frame(name, build, season=CURRENT_SEASON):
+    """
+    Returns a frame published for the current state of a season's workbooks, building and publishing it
+    first if no process has yet. Versions published for older workbooks are removed; processes still
+    attached to them keep their mapping.\n
+
+    Args:
+        name - Frame name, e.g. "raw".
+        build - Function building the frame.
+        season - Season, a SEASONS key.
+
+    Returns:
+        The attached frame, or the built one if it couldn't be published.
+    """
+    path = shared_path(name, season)
+    frame = attach_frame(path)
+    if frame is not None:
+        return frame
+
+    frame = build()
+    try:
+        os.makedirs(SHARED_DIR, exist_ok=True)
+        publish_frame(frame, path)
+    except OSError:
+        return frame
+    for older in glob.glob(os.path.join(SHARED_DIR, f"{season.replace('/', '-')}_{name}_v*")):
+        if older != path and not older.endswith(".tmp"):
+            shutil.rmtree(older, ignore_errors=True)
+    # The attached copy lives in the page cache, shared with every other process, unlike the built one.
+    attached = attach_frame(path)
+    return frame if attached is None else attached
+
+
+def pool_minutes(min_minutes):
+    """
+    Rounds a player pool's minutes threshold down to a multiple of MINUTES_STEP, between 0 and MAX_MINUTES.
+    """
+    return int(min(max(float(min_minutes), 0), MAX_MINUTES) // MINUTES_STEP * MINUTES_STEP)
+
+
+class Dataset:
+    """
+    A season's data, built lazily: every table and derived frame is loaded or computed the first time it
+    is read and kept afterwards, so a page only pays for what it uses, e.g. the leaderboards never derive
+    the per 90 stats. The raw and per 90 frames are shared between processes with shared_frame: the first
+    process to need one builds and publishes it, the others memory-map it.\n
+
+    Args:
+        season - Season, a SEASONS key.
+        loader - Function (league, sheet, season) -> merged league dataframe. Defaults to load_league;
+                 the app passes its own to cache every league separately.
+    """
+    def __init__(self, season=CURRENT_SEASON, loader=None):
+        self.season = season
+        self.leagues = season_leagues(season)
+        self._loader = loader or load_league
+        self._lock = threading.RLock()
+        self._memo = {}
+        self._pools = collections.OrderedDict()
+
+    def _cached(self, key, build):
+        with self._lock:
+            if key not in self._memo:
+                self._memo[key] = build()
+            return self._memo[key]
+
+    def _pooled(self, key, build):
+        # Like _cached, for tables of a player pool, of which only the POOL_CACHE_SIZE last used are kept.
+        with self._lock:
+            if key in self._pools:
+                self._pools.move_to_end(key)
+            else:
+                self._pools[key] = build()
+                while len(self._pools) > POOL_CACHE_SIZE:
+                    self._pools.popitem(last=False)
+            return self._pools[key]
+
+    @property
+    def raw(self):
+        """Raw stats for all leagues, merged and compacted, with their METRICS."""
+        def build():
+            # Parses every stale workbook of the season at once, across processes, before the first read.
+            refresh_cache(season=self.season, leagues=self.leagues)
+            frames = {league: self._loader(league, "raw", self.season) for league in self.leagues}
+            return derive_metrics(compact_frame(merge_leagues(**frames)))
+        return self._cached("raw", lambda: shared_frame("raw", build, self.season))
+
+    @property
+    def per_90(self):
+        """Per 90 stats for all leagues, see per_90_frame, with their METRICS."""
+        return self._cached("per_90", lambda: shared_frame("per_90", lambda: derive_metrics(per_90_frame(self.raw)),
+                                                               self.season))
+
+    @property
+    def radar(self):
+        """The radar_table of the per 90 stats and its metric_ranges."""
+        def build():
+            rdat = radar_table(self.per_90)
+            return rdat, metric_ranges(rdat)
+        return self._cached("radar", build)
+
+    @property
+    def minutes(self):
+        """The minutes_table of the per 90 stats."""
+        return self._cached("minutes", lambda: minutes_table(self.per_90))
+
+    def leaderboards(self, per_90=False):
+        """The leaderboard_index of the raw or per 90 stats."""
+        return self._cached(("leaderboards", per_90),
+                            lambda: leaderboard_index(self.per_90 if per_90 else self.raw))
+
+    def percentiles(self, min_minutes=0, leagues=None, by_position=False):
+        """The percentile table of a player pool, see load_percentiles and pool_minutes."""
+        min_minutes = pool_minutes(min_minutes)
+        unknown = [league for league in leagues or [] if league not in LEAGUES.values()]
+        if unknown:
+            raise KeyError(f"Unknown league {unknown[0]!r}")
+        leagues = tuple(sorted(set(leagues))) if leagues else None
+        return self._pooled(("percentiles", min_minutes, leagues, by_position),
+                            lambda: load_percentiles(lambda: self.per_90, min_minutes=min_minutes, leagues=leagues,
+                                                     season=self.season, by_position=by_position))
+
+    def similarity(self, min_minutes=0, normalize="zscore"):
+        """The similarity_index of a player pool, see pool_minutes."""
+        min_minutes = pool_minutes(min_minutes)
+        return self._pooled(("similarity", min_minutes, normalize),
+                            lambda: similarity_index(self.per_90, min_minutes=min_minutes, normalize=normalize))
+
+
+@timing.timed
+def leaderboard_index(data):
+    """
+    Sorts every stat once, overall and within each league, so that any leaderboard is a slice.\n
+
+    Args:
+        data - Stats for all leagues, Dataset.raw or Dataset.per_90.
+
+    Returns:
+        A dict keyed by league name, and None for all leagues, of dataframes with one int32 column
+        per stat holding data's row positions from best to worst. Missing values come last.
+    """
+    stats = [column for column in data.columns if column not in ENCODED_COLUMNS]
+    matrix = data[stats].to_numpy(dtype="float32")
+    scopes = {None: np.arange(len(data))}
+    for league in data["League"].unique():
+        scopes[league] = np.flatnonzero((data["League"] == league).to_numpy())
+
+    index = {}
+    for league, positions in scopes.items():
+        # Sorting the negated values puts the highest first and keeps NaN last; stable keeps row order on ties.
+        order = np.argsort(-matrix[positions], axis=0, kind="stable")
+        index[league] = pd.DataFrame(positions[order].astype("int32"), columns=stats)
+    return index
+
+
+def leaderboard(data, index, metric, league=None, top=10, offset=0):
+    """
+    Returns a page of a leaderboard from a leaderboard_index, without sorting.\n
+
+    Args:
+        data - The data the index was built on.
+        index - The index returned by leaderboard_index.
+        metric - Stat to rank by.
+        league - League name. Defaults to all leagues.
+        top, offset - Page of the ranking to return.
+
+    Returns:
+        Player, Squad, League and the metric, best first.
+    """
+    rows = index[league][metric].to_numpy()[offset:offset + top]
+    return data[["Player","Squad","League",metric]].iloc[rows]
+
+
+@timing.timed
 def scatter_variables(data):    # Variables to appear on the x,y scatterplot
     """
     A function  that defines the data that will appear on the scatterplots, as well as the radar plots. The data should ideally be per 90. \n
@@ -151,140 +911,133 @@ def scatter_variables(data):    # Variables to appear on the x,y scatterplot
     Returns:
         Data to be plotted on the scatterplots as well as comparative radar plots.
     """
-    dat = data[["Player","Squad","Goals Scored","Assists","Goals + Assists", "Non-Penalty Goals","Penalties Scored","Penalties Attempted",
-               "Yellow Cards", "Red Cards","Expected Goals","Non-Penalty Expected Goals","Expected Assists",
-               "Progressive Carries","Progressive Passes","Progressive Passes Received_x","Touches","Touches in the Defensive Penalty Area",
-               "Defensive 1/3 Touches","Middle 1/3 Touches","Touches in the Attacking Third","Attacking Penalty Area Touches",
-               "Dribbles Attempted","Dribble Success %","Carries", "Total Carry Distance","PrgDist_x","PrgC","Carries into the Penalty Area",
-                "Passes Received","Passes Attempted","Pass Completion %","TotDist",
-                "PrgDist_y","Cmp.1","Att.1","Cmp%.1","Cmp.2","Att.2","Cmp%.2","Cmp.3","Att.3","Cmp%.3","xA Overperformance",
-                "Key Passes","Passes into the Penalty Area","Crosses into the Penalty Area","Live_y","Dead","TB",
-                "Switches","Crs_x","CK","Fouls","Fouls Drawn","Penalty Kicks Won","PKcon","Recoveries","Won",
-                "Aerial Duel Success Rate","Tackles","TklW_y","Def 3rd","Mid 3rd","Att 3rd","Int_y","Tkl+Int","Clr","Err","Tackle Success Rate","League"]]
-    
-    dat = dat.rename(columns={"Progressive Passes Received_x":"Progressive Passes Received","PrgDist_x":"Progressive Carrying Distance",
-                               "PrgDist_y":"Progressive Passing Distance","Cmp.1":"Short Passes Completed","Att.1":"Short Passes Attempted",
-                               "Cmp%.1":"Short Pass Completion %", "Cmp.2":"Medium Passes Completed","Att.2":"Medium Passes Attempted",
-                               "Cmp%.2":"Medium Pass Completion %","Cmp.3":"Long Passes Completed","Att.3":"Long Passes Attempted",
-                               "Cmp%.3":"Long Pass Completion %","Live_y":"Live Ball Passes","Dead":"Dead Ball Passes","TB":"Through Balls",
-                               "Crs_x":"Crosses","CK":"Corner Kicks","TklW_y":"Tackles Won","Def 3rd":"Defensive 3rd Tackles",
-                               "Mid 3rd":"Middle 3rd Tackles","Att 3rd":"Attacking 3rd Tackles","Int_y":"Interceptions","Tkl+Int":"Tackles + Interceptions",
-                               "Clr":"Clearances","Err":"Errors Leading to a Shot"})
-    
-    print(dat.columns)
+    columns = SCATTER_COLUMNS + [name for name in METRICS if name not in SCATTER_COLUMNS]
+    dat = data[["Player","Squad"] + columns + ["League"]]
     return dat
     
     
-def comparison_radar(rdat,player_1,player_2):
+@timing.timed
+def minutes_table(dat):
     """
-    Plots a radar chart comparing two players.
+    Builds the scatterplot data once, sorted by minutes played, so that a minutes threshold is a binary
+    search instead of a mask over the whole frame.\n
 
     Args:
-        rdat = Dataframe containing the variables to be plotted. Must include "Player" and "Squad".\n  
-        player_1 = Player on the chart. Selected from the selectbox provided.\n  
-        player_2 = Player on the chart. Selected from the selecttbox provided.  
+        dat - Per 90 data for all leagues, Dataset.per_90.
 
     Returns:
-        Comparative radar chart displaying two players' characteristics, as well as their names and the club they play for.
+        table - The scatter_variables data, in a compact frame, from fewest to most minutes played.
+        minutes - The matching minutes played, ascending, as a read-only array.
+    """
+    minutes = dat["Minutes Played"].to_numpy(dtype="float32")
+    order = np.argsort(minutes, kind="stable")
+    # A minutes threshold never keeps players without minutes, so they are left out altogether.
+    order = order[~np.isnan(minutes[order])]
+    table = compact_frame(scatter_variables(dat.iloc[order]).reset_index(drop=True))
+    minutes = minutes[order]
+    minutes.flags.writeable = False
+    return table, minutes
+
 
+def above_minutes(table, minutes, threshold):
     """
-    params = list(rdat.columns)
-    params = params[2:]
+    Selects the players of a minutes_table with more minutes played than a threshold.\n
 
-    ranges =  []
-    for x in params:
-        a = min(rdat[params][x])
-        a = a - (a*0.25)
+    Args:
+        table, minutes - As returned by minutes_table.
+        threshold - Minimum minutes played, exclusive.
 
-        b = max(rdat[params][x])
-        b = b + (b*0.25)
-        ranges.append((a,b))
+    Returns:
+        A view of the table's last rows; nothing is copied.
+    """
+    return table.iloc[np.searchsorted(minutes, threshold, side="right"):]
 
-    a_values = rdat[rdat["Player"]==player_1].iloc[0].values[2:].tolist()
-    b_values = rdat[rdat["Player"]==player_2].iloc[0].values[2:].tolist()
-    values = [a_values, b_values]
-    a_team = rdat[rdat["Player"]==player_1]["Squad"].values[0]
-    b_team = rdat[rdat["Player"]==player_2]["Squad"].values[0]
-    print(a_team)
-    print(b_team)
 
-    title = dict(
-        title_name = player_1,
-        title_color="red",
-        subtitle_name =a_team,
-        subtitle_color = "red",
-        title_name_2=player_2,
-        title_color_2="blue",
-        subtitle_name_2=b_team,
-        subtitle_color_2 = "blue",
-        title_fontsize = 18,
-        subtitle_fontsize=15
-    )
+@timing.timed
+def binned_counts(dat, x, y, bins=40):
+    """
+    Aggregates two metrics into a grid of player counts, for scatterplots with too many points to draw.\n
 
-    endnote = "Data Courtesy of FBref. All stats are presented per 90 minutes played."
+    Args:
+        dat - Data holding both metrics, e.g. from above_minutes.
+        x, y - Metrics on each axis.
+        bins - Number of bins along each axis.
 
-    radar = Radar()
+    Returns:
+        One row per non-empty cell: its x_start, x_end, y_start and y_end edges and its number of Players.
+    """
+    values = dat[[x, y]].to_numpy(dtype="float64")
+    values = values[~np.isnan(values).any(axis=1)]
+    counts, x_edges, y_edges = np.histogram2d(values[:, 0], values[:, 1], bins=bins)
+    i, j = np.nonzero(counts)
+    return pd.DataFrame({"x_start": x_edges[i], "x_end": x_edges[i + 1],
+                         "y_start": y_edges[j], "y_end": y_edges[j + 1],
+                         "Players": counts[i, j].astype("int32")})
 
-    fig,ax = radar.plot_radar(ranges=ranges, params=params, values=values, radar_color=['red','blue'],title=title, endnote = endnote,compare=True)
 
-    st.pyplot(fig)
+@timing.timed
+def radar_table(dat):
+    """
+    Builds the data behind the per 90 radar charts, indexed by (Player, Squad) so a player's row is a
+    hash lookup and players sharing a name stay apart.\n
 
+    Args:
+        dat - Per 90 data for all leagues, Dataset.per_90.
 
-### Percentiles Radar
+    Returns:
+        The scatter_variables data indexed by (Player, Squad).
+    """
+    return scatter_variables(dat).set_index(["Player","Squad"])
 
-def get_percentiles(df, columns):
+
+@timing.timed
+def metric_ranges(rdat):
     """
-    Ranks players' various variables by percentile.\n
+    Computes the axis range of every radar variable: 25% below its minimum to 25% above its maximum.\n
 
     Args:
-        data - The data whose variables we want to convert innto percentiles.
-        columns - The column names of the data
+        rdat - Radar data, as returned by radar_table.
 
-    Returns: 
-        Data in percentile form.
+    Returns:
+        A dataframe indexed by variable, with "min" and "max" columns.
     """
-    percentile_df = df.copy()
-    for column in columns:
-        if column not in ['Player', 'Squad', 'League']:  # Skip non-numeric columns
-            percentile_df[column ] = df[column].rank(pct=True) * 100
-    print(percentile_df.columns)
-    return percentile_df
+    numeric = rdat.select_dtypes("number")
+    low = numeric.min()
+    high = numeric.max()
+    return pd.DataFrame({"min": low - (low*0.25), "max": high + (high*0.25)})
 
-    
 
-    
-def percentile_comparison_radar(rdat,player_1,player_2):
+def player_label(player):
     """
-    Plots a radar chart comparing two players, in terms of their percentile ranks.
+    Formats a (Player, Squad) key for display in a selectbox.
+    """
+    return f"{player[0]} ({player[1]})"
+
+
+@timing.timed
+def comparison_radar(rdat,player_1,player_2,ranges):
+    """
+    Plots a radar chart comparing two players.
 
     Args:
-        rdat = Dataframe containing the variables to be plotted(In percentiles). Must include "Player" and "Squad".\n  
-        player_1 = Player on the chart. Selected from the selectbox provided.\n  
-        player_2 = Player on the chart. Selected from the selecttbox provided.  
+        rdat = Dataframe indexed by (Player, Squad), containing the variables to be plotted.\n  
+        player_1 = (Player, Squad) on the chart. Selected from the selectbox provided.\n  
+        player_2 = (Player, Squad) on the chart. Selected from the selecttbox provided.\n  
+        ranges = Axis ranges from metric_ranges.
 
     Returns:
-        Comparative radar chart displaying two players' characteristics, as well as their names and the club they play for.
+        Comparative radar chart figure displaying two players' characteristics, as well as their names and the club they play for.
 
     """
     params = list(rdat.columns)
-    params = params[2:]
-
-    ranges =  []
-    for x in params:
-        a = 0
-        a = 0
 
-        b = 100
-        b = 100
-        ranges.append((a,b))
+    ranges = ranges.loc[params]
 
-    a_values = rdat[rdat["Player"]==player_1].iloc[0].values[2:].tolist()
-    b_values = rdat[rdat["Player"]==player_2].iloc[0].values[2:].tolist()
-    values = [a_values, b_values]
-    a_team = rdat[rdat["Player"]==player_1]["Squad"].values[0]
-    b_team = rdat[rdat["Player"]==player_2]["Squad"].values[0]
-    print(a_team)
-    print(b_team)
+    # soccerplots can't draw a missing value, e.g. a success rate without attempts, so it sits at the axis minimum.
+    values = [rdat.loc[player_1].fillna(ranges["min"]).tolist(), rdat.loc[player_2].fillna(ranges["min"]).tolist()]
+    ranges = list(ranges.itertuples(index=False, name=None))
+    player_1, a_team = player_1
+    player_2, b_team = player_2
 
     title = dict(
         title_name = player_1,
@@ -305,39 +1058,344 @@ def percentile_comparison_radar(rdat,player_1,player_2):
 
     fig,ax = radar.plot_radar(ranges=ranges, params=params, values=values, radar_color=['red','blue'],title=title, endnote = endnote,compare=True)
 
-    st.pyplot(fig)
+    return fig
 
 
+@timing.timed
+def figure_to_png(fig):
+    """
+    Renders a matplotlib figure to PNG and closes it, so the figure doesn't stay in pyplot's registry.\n
 
+    Args:
+        fig - The figure to render.
 
+    Returns:
+        The PNG image as bytes.
+    """
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
 
 
+### Percentiles Radar
 
+def rank_percentiles(matrix, groups=None, chunk_size=2**20):
+    """
+    Ranks every column of a metric matrix by percentile within groups of rows, all groups at once. Each
+    value is packed with its group and row number into one integer, ordered as (group, value, row), so a
+    single sort of the integers sorts every group's values together and carries the rows along with them.
+    Ties get their average rank, as in pandas' rank(pct=True).\n
 
+    Args:
+        matrix - float matrix with a row per player and a column per metric.
+        groups - Group label of each row, e.g. from position_groups. Defaults to ranking all rows together.
+        chunk_size - Values ranked at a time, a few columns' worth, which bounds the working memory.
 
+    Returns:
+        A float32 matrix of percentiles between 0 and 100, missing where the matrix is.
+    """
+    matrix = np.asarray(matrix, dtype="float32")
+    rows, columns = matrix.shape
+    ranks = np.full((columns, rows), np.nan, dtype="float32")
+    if not rows or not columns:
+        return ranks.T
+    codes = np.zeros(rows, dtype="int64") if groups is None else np.unique(np.asarray(groups), return_inverse=True)[1]
+    sizes = np.bincount(codes)
+    # Values present per group and column, counted without a (groups x rows) indicator matrix.
+    present = np.stack([np.bincount(codes, weights=column, minlength=len(sizes))
+                        for column in (~np.isnan(matrix)).T], axis=1)
+    # Sorted by group first, every column has the same group at each sorted position: its values start
+    # at the group's offset, missing ones last.
+    offsets = np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+    shift = (rows - 1).bit_length()
+    packable = 32 + (len(sizes) - 1).bit_length() + shift <= 64
+    position = np.arange(rows, dtype="int32")
+    step = max(1, chunk_size // rows)
+    for start in range(0, columns, step):
+        stop = min(start + step, columns)
+        # Order-preserving unsigned keys for the float32 values: negative values have every bit flipped,
+        # positive ones the sign bit. -0.0 counts as 0.0 and missing values sort last.
+        values = np.ascontiguousarray(matrix[:, start:stop].T) + np.float32(0)
+        bits = values.view("uint32")
+        bits = bits ^ ((values.view("int32") >> 31).view("uint32") | np.uint32(1 << 31))
+        bits[np.isnan(values)] = np.uint32(0xFFFFFFFF)
+        keys = (codes.astype("uint64") << np.uint64(32)) | bits
+
+        if packable:
+            packed = np.sort((keys << np.uint64(shift)) | position.astype("uint64"), axis=1)
+            order = (packed & np.uint64((1 << shift) - 1)).astype("intp")
+            keys = packed >> np.uint64(shift)
+        else:
+            # Too many rows to pack, so the rows are sorted along, more slowly.
+            order = np.argsort(keys, axis=1, kind="stable")
+            keys = np.take_along_axis(keys, order, axis=1)
+
+        # Position of the first and last value of each value's run of ties.
+        tie_start = np.ones(keys.shape, dtype=bool)
+        tie_start[:, 1:] = keys[:, 1:] != keys[:, :-1]
+        tie_end = np.ones(keys.shape, dtype=bool)
+        tie_end[:, :-1] = tie_start[:, 1:]
+        low = np.maximum.accumulate(np.where(tie_start, position, 0), axis=1)
+        high = np.minimum.accumulate(np.where(tie_end, position, rows - 1)[:, ::-1], axis=1)[:, ::-1]
+
+        # Each value is ranked among its group's rows where its column isn't missing.
+        counts = np.repeat(present[:, start:stop].T, sizes, axis=1)
+        rank = (low + high) * 0.5 - offsets + 1
+        percentiles = np.where(rank <= counts, rank / np.maximum(counts, 1) * 100, np.nan).astype("float32")
+        np.put_along_axis(ranks[start:stop], order, percentiles, axis=1)
+    return ranks.T
+
+
+def position_groups(pos):
+    """
+    Maps players' positions to their POSITION_GROUPS index: "MF,FW" -> 2. Players without a known
+    position get their own group, len(POSITION_GROUPS).
+    """
+    pos = pos.astype("category")
+    primary = pos.cat.categories.str.split(",").str[0]
+    lookup = np.array([POSITION_GROUPS.index(group) if group in POSITION_GROUPS else len(POSITION_GROUPS)
+                       for group in primary] + [len(POSITION_GROUPS)])
+    # Missing positions have code -1, which picks the lookup's last entry.
+    return lookup[pos.cat.codes.to_numpy()]
 
 
+def get_percentiles(df, columns):
+    """
+    Ranks players' various variables by percentile.\n
 
+    Args:
+        data - The data whose variables we want to convert innto percentiles.
+        columns - The column names of the data
 
+    Returns: 
+        Data in percentile form.
+    """
+    columns = [column for column in columns if column not in ['Player', 'Squad', 'League']]  # Skip non-numeric columns
+    percentiles = pd.DataFrame(rank_percentiles(df[columns].to_numpy(dtype="float32")), columns=columns, index=df.index)
+    return pd.concat([df.drop(columns=columns), percentiles], axis=1)[df.columns]
 
 
+@timing.timed
+def percentile_table(dat, min_minutes=0, leagues=None, by_position=False):
+    """
+    Ranks every scatter_variables metric by percentile within a pool of players.\n
 
+    Args:
+        dat - Per 90 data for all leagues, Dataset.per_90.
+        min_minutes - Only players with more minutes than this are ranked.
+        leagues - League names to rank against. Defaults to all of them.
+        by_position - Rank each player only against the pool's players of the same POSITION_GROUPS group,
+                      so that e.g. a centre-back's Key Passes are measured against other defenders.
 
+    Returns:
+        A dataframe indexed by (Player, Squad), holding a float32 percentile column per metric.
+    """
+    pool = dat[dat["Minutes Played"] > min_minutes]
+    if leagues is not None:
+        pool = pool[pool["League"].isin(leagues)]
+    groups = position_groups(pool["Pos"]) if by_position else None
+    pool = scatter_variables(pool)
 
+    columns = [column for column in pool.columns if column not in ['Player', 'Squad', 'League']]
+    ranks = rank_percentiles(pool[columns].to_numpy(dtype="float32"), groups)
+    return pd.DataFrame(ranks, columns=columns, index=pd.MultiIndex.from_frame(pool[["Player","Squad"]]), copy=False)
 
 
+@timing.timed
+def load_percentiles(dat, min_minutes=0, leagues=None, season=CURRENT_SEASON, by_position=False):
+    """
+    Returns the percentile table of a player pool, computing it only the first time. Tables are published
+    in SHARED_DIR with publish_frame, one per minutes filter, league scope, position grouping and version
+    of that scope's workbooks, so an update to one league leaves the other leagues' tables valid, and every
+    process maps the same copy. Publishing a table removes the scope's tables of older versions, and its
+    least recently published ones past PERCENTILE_TABLES.\n
 
+    Args:
+        dat - Per 90 data for all leagues, Dataset.per_90, or a function returning it, which is
+              only called if the table isn't stored yet.
+        min_minutes - Only players with more minutes than this are ranked.
+        leagues - League names to rank against. Defaults to all of them.
+        season - Season of dat, a SEASONS key.
+        by_position - Rank players within their position group, see percentile_table.
 
+    Returns:
+        The table built by percentile_table.
+    """
+    scope = "all" if leagues is None else ",".join(sorted(leagues))
+    prefixes = [prefix for prefix in season_leagues(season) if leagues is None or LEAGUES[prefix] in leagues]
+    # e.g. "23-24_percentiles_<scope hash>_900_position_v3_<metrics version>_<workbooks version>"
+    version = f"v{CACHE_VERSION}_{METRICS_VERSION}_{dataset_version(prefixes, season)}"
+    prefix = f"{season.replace('/', '-')}_percentiles_{hashlib.sha1(scope.encode()).hexdigest()[:8]}_"
+    pool = f"{min_minutes}_position" if by_position else f"{min_minutes}"
+    path = os.path.join(SHARED_DIR, f"{prefix}{pool}_{version}")
+    table = attach_frame(path)
+    if table is not None:
+        return table
+
+    table = percentile_table(dat() if callable(dat) else dat, min_minutes=min_minutes, leagues=leagues,
+                             by_position=by_position)
+    try:
+        os.makedirs(SHARED_DIR, exist_ok=True)
+        publish_frame(table, path)
+    except OSError:
+        return table
+    # Tables named "percentiles_<hash>" predate the version in the name and can't be matched to a scope.
+    for older in glob.glob(os.path.join(SHARED_DIR, f"{prefix}*")) + glob.glob(os.path.join(SHARED_DIR, "percentiles_*")):
+        if not older.endswith(f"_{version}") and not older.endswith(".tmp"):
+            shutil.rmtree(older, ignore_errors=True)
+    current = sorted((other for other in glob.glob(os.path.join(SHARED_DIR, f"{prefix}*_{version}")) if other != path),
+                     key=lambda other: os.path.getmtime(other) if os.path.exists(other) else 0)
+    for older in current[:max(len(current) + 1 - PERCENTILE_TABLES, 0)]:
+        shutil.rmtree(older, ignore_errors=True)
+    attached = attach_frame(path)
+    return table if attached is None else attached
 
+    
 
+    
+@timing.timed
+def percentile_comparison_radar(rdat,player_1,player_2,by_position=False):
+    """
+    Plots a radar chart comparing two players, in terms of their percentile ranks.
 
+    Args:
+        rdat = Percentile table from load_percentiles, indexed by (Player, Squad), containing the variables to be plotted.\n  
+        player_1 = (Player, Squad) on the chart. Selected from the selectbox provided.\n  
+        player_2 = (Player, Squad) on the chart. Selected from the selecttbox provided.\n  
+        by_position = Whether rdat ranks players within their position group, which the endnote states.
 
+    Returns:
+        Comparative radar chart figure displaying two players' characteristics, as well as their names and the club they play for.
 
+    """
+    params = list(rdat.columns)
+
+    ranges = [(0, 100)] * len(params)
+
+    # A missing value, e.g. a success rate without attempts, has no rank and sits at the axis minimum.
+    values = [rdat.loc[player_1].fillna(0).tolist(), rdat.loc[player_2].fillna(0).tolist()]
+    player_1, a_team = player_1
+    player_2, b_team = player_2
+
+    title = dict(
+        title_name = player_1,
+        title_color="red",
+        subtitle_name =a_team,
+        subtitle_color = "red",
+        title_name_2=player_2,
+        title_color_2="blue",
+        subtitle_name_2=b_team,
+        subtitle_color_2 = "blue",
+        title_fontsize = 18,
+        subtitle_fontsize=15
+    )
+
+    endnote = "Data Courtesy of FBref. All stats are presented per 90 minutes played."
+    if by_position:
+        endnote += " Percentiles rank each player against players of the same position."
 
+    radar = Radar()
+
+    fig,ax = radar.plot_radar(ranges=ranges, params=params, values=values, radar_color=['red','blue'],title=title, endnote = endnote,compare=True)
 
+    return fig
 
 
+### Similar Players
+
+@timing.timed
+def similarity_index(dat, min_minutes=0, normalize="zscore"):
+    """
+    Precomputes the matrices behind similar_players: every scatter_variables metric is normalized, then
+    each player's row is scaled to unit length, once for all metrics and once per template, so that a
+    similarity search is a single matrix product.\n
+
+    Args:
+        dat - Per 90 data for all leagues, Dataset.per_90.
+        min_minutes - Only players with more minutes than this are searched.
+        normalize - "zscore" to standardize each metric, or "percentile" to rank it first.
+
+    Returns:
+        players - Player, Squad and League of each row of the matrices.
+        matrices - A dict keyed by template name, and None for all metrics, of float32 matrices with a row
+        per player.
+    """
+    pool = scatter_variables(dat[dat["Minutes Played"] > min_minutes])
+    players = pool[["Player","Squad","League"]].reset_index(drop=True)
+    metrics = pool.drop(columns=["Player","Squad","League"])
+    values = metrics.to_numpy(dtype="float32")
+    if normalize == "percentile":
+        values = rank_percentiles(values)
+    elif normalize != "zscore":
+        raise ValueError(f"Unknown normalization {normalize!r}")
+
+    std = np.nanstd(values, axis=0)
+    values = (values - np.nanmean(values, axis=0)) / np.where(std > 0, std, 1)
+    # A missing metric counts as an average one.
+    values = np.nan_to_num(values)
+
+    matrices = {}
+    for template, columns in [(None, list(metrics.columns))] + list(TEMPLATES.items()):
+        matrix = values[:, [metrics.columns.get_loc(column) for column in columns]]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.ascontiguousarray(matrix / np.where(norms > 0, norms, 1), dtype="float32")
+        matrix.flags.writeable = False
+        matrices[template] = matrix
+    return players, matrices
+
+
+@timing.timed
+def nearest_players(matrix, rows, top=10, batch_size=1024):
+    """
+    Finds the most similar players to several players at once, by cosine similarity.\n
 
+    Args:
+        matrix - A matrix from similarity_index.
+        rows - Row positions of the players to search for.
+        top - Number of similar players per player.
+        batch_size - Players compared per matrix product, which bounds memory on large pools.
 
+    Returns:
+        positions - (len(rows), top) row positions of the most similar players, most similar first.
+        scores - The matching cosine similarities, from -1 to 1.
+    """
+    rows = np.asarray(rows)
+    top = min(top, len(matrix) - 1)
+    positions = np.empty((len(rows), top), dtype="int64")
+    scores = np.empty((len(rows), top), dtype="float32")
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        similarity = matrix[batch] @ matrix.T
+        # A player is not similar to themselves.
+        similarity[np.arange(len(batch)), batch] = -np.inf
+        best = np.argpartition(-similarity, top - 1, axis=1)[:, :top]
+        order = np.argsort(-np.take_along_axis(similarity, best, axis=1), axis=1, kind="stable")
+        best = np.take_along_axis(best, order, axis=1)
+        positions[start:start + len(batch)] = best
+        scores[start:start + len(batch)] = np.take_along_axis(similarity, best, axis=1)
+    return positions, scores
+
+
+def similar_players(players, matrices, player, template=None, top=10):
+    """
+    Lists the players most similar to one player, across all leagues.\n
 
+    Args:
+        players, matrices - As returned by similarity_index.
+        player - (Player, Squad) key.
+        template - Template whose metrics are compared. Defaults to all metrics.
+        top - Number of players to return.
 
+    Returns:
+        Player, Squad, League and Similarity, the cosine similarity of normalized per 90 stats as a
+        percentage, most similar first.
+    """
+    rows = np.flatnonzero((players["Player"] == player[0]).to_numpy() & (players["Squad"] == player[1]).to_numpy())
+    if len(rows) == 0:
+        raise KeyError(f"{player_label(player)} not found")
+    positions, scores = nearest_players(matrices[template], rows[:1], top=top)
+    similar = players.iloc[positions[0]].reset_index(drop=True)
+    similar["Similarity"] = scores[0] * 100
+    return similar
@@ -0,0 +1,428 @@
+"""
+Load test of the dashboard: many scouting sessions use app.py at once, each scripted as a random walk
+through the three pages, and every rerun is timed.
+
+    python loadtest.py                                # 1, 4 and 16 concurrent sessions
+    python loadtest.py --sessions 8 32 --steps 50 --think 1
+    python loadtest.py --url ws://dashboard:8501 --sessions 8
+    python loadtest.py --compare before.json          # report the change against an earlier run
+    python loadtest.py --cold --sessions 1            # start the server without any cached data
+
+The app is served by a real Streamlit server, started on --port unless --url points at a running one, and
+every session is a client speaking Streamlit's own websocket protocol, as a browser tab does; no browser
+or external service is needed. A session opens a page, then keeps interacting with it: switching leagues,
+metrics and the number of leaders shown, dragging the minutes slider through several values, or picking
+players and templates on the comparison radars, and now and then moves to another page.
+
+Each level of concurrency reports the p50, p95 and p99 rerun latency, from sending an interaction to the
+end of the rerun it triggers, overall and per page, the reruns served per second, the bytes sent per rerun
+and, for a server started here, the resident memory each session added to it. One session visits every
+page beforehand, so the levels measure a warm server; with --cold, data/cache is removed before the server
+starts, so that visit measures a cold start. A page failing during that visit stops the test. Results are
+written as JSON, like benchmark.py's.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+import numpy as np
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from websockets.sync.client import connect
+
+import functions
+from benchmark import git_commit
+
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+PAGES = ["Stat Leaders","Plot Metrics","Player Comparison"]
+WIDGETS = ["selectbox","slider","checkbox","radio","number_input"]
+
+# Chance that a session's next action moves it to another page.
+PAGE_SWITCH = 0.15
+
+
+class Session:
+    """
+    One browser tab: a connection to the server, the widgets its last rerun drew and the values the
+    session has given them.
+    """
+    def __init__(self, url, page, timeout):
+        # Entered by hand rather than in a with block, as a session outlives the call that connects it.
+        self.connection = connect(f"{url}/_stcore/stream", subprotocols=["streamlit"], max_size=None,
+                                  compression=None).__enter__()
+        self.page = page
+        self.timeout = timeout
+        self.widgets = []
+        self.states = {}
+
+    def close(self):
+        self.connection.close()
+
+    def rerun(self):
+        """
+        Reruns the app with the session's page and widget values, as a browser does after an interaction,
+        and waits for the rerun to finish.\n
+
+        Returns:
+            The rerun's duration in milliseconds, the bytes received and the app's error, if any.
+        """
+        message = BackMsg()
+        message.rerun_script.query_string = f"page={self.page.replace(' ', '+')}"
+        drawn = {widget.id for _, widget in self.widgets}
+        message.rerun_script.widget_states.widgets.extend(state for id, state in self.states.items() if id in drawn)
+
+        widgets, error, received = [], None, 0
+        start = time.perf_counter()
+        self.connection.send(message.SerializeToString())
+        while True:
+            data = self.connection.recv(timeout=self.timeout)
+            received += len(data)
+            forward = ForwardMsg()
+            forward.ParseFromString(data)
+            kind = forward.WhichOneof("type")
+            if kind == "script_finished":
+                break
+            if kind != "delta" or forward.delta.WhichOneof("type") != "new_element":
+                continue
+            element = forward.delta.new_element
+            element_kind = element.WhichOneof("type")
+            if element_kind in WIDGETS:
+                widgets.append((element_kind, getattr(element, element_kind)))
+            elif element_kind == "exception":
+                error = error or f"{element.exception.type}: {element.exception.message}"
+        elapsed = time.perf_counter() - start
+        self.widgets = widgets
+        return round(elapsed * 1000, 3), received, error
+
+    def find(self, kind, label):
+        """
+        Returns the widgets of a kind, e.g. "selectbox", and label drawn by the last rerun.
+        """
+        widgets = [widget for widget_kind, widget in self.widgets if widget_kind == kind and widget.label == label]
+        if not widgets:
+            raise LookupError(f"no {kind} {label!r} on {self.page}")
+        return widgets
+
+    def set(self, widget, field, value):
+        """
+        Gives a widget a value, sent with the next rerun.\n
+
+        Args:
+            widget - Widget proto, from find.
+            field - WidgetState field of the widget's kind, e.g. "string_value".
+            value - The value.
+        """
+        state = WidgetState(id=widget.id)
+        if field.endswith("_array_value"):
+            getattr(state, field).data.extend(value)
+        else:
+            setattr(state, field, value)
+        self.states[widget.id] = state
+
+
+def choose(session, kind, label, rng):
+    """
+    Picks a random option of a selectbox or radio.
+    """
+    widget = rng.choice(session.find(kind, label))
+    session.set(widget, "string_value", rng.choice(widget.options))
+
+
+def leaders_actions(session, rng):
+    """
+    Returns the next interaction on the Stat Leaders page, as (name, list of steps); every step is
+    followed by a rerun.
+    """
+    action = rng.choice(["league", "metric", "top"])
+    if action == "league":
+        return action, [lambda: choose(session, "selectbox", "Select League:", rng)]
+    if action == "metric":
+        return action, [lambda: choose(session, "selectbox", "Select Stat:", rng)]
+    return action, [lambda: session.set(session.find("number_input", "Show top:")[0], "double_value",
+                                        rng.randrange(5, 101, 5))]
+
+
+def metrics_actions(session, rng):
+    """
+    Returns the next interaction on the Plot Metrics page, see leaders_actions. A slider drag reruns once
+    per value it passes through, as Streamlit does when the slider is released at each.
+    """
+    action = rng.choice(["slider", "slider", "axis", "binned"])
+    if action == "slider":
+        slider = session.find("slider", "Select Minimum Minutes Played:")[0]
+        low, high, step = int(slider.min), int(slider.max), int(slider.step)
+        start = rng.randrange(low, high + 1, step)
+        direction = rng.choice([-1, 1]) * step
+        values = [min(max(start + i * direction, low), high) for i in range(rng.randint(3, 6))]
+        return action, [lambda value=value: session.set(session.find("slider", slider.label)[0], "double_array_value", [value])
+                        for value in values]
+    if action == "axis":
+        return action, [lambda: choose(session, "selectbox", rng.choice(["Select a metric", "Select metric"]), rng)]
+
+    def toggle():
+        checkbox = next(widget for kind, widget in session.widgets if kind == "checkbox")
+        state = session.states.get(checkbox.id)
+        session.set(checkbox, "bool_value", not (state.bool_value if state else checkbox.default))
+    return action, [toggle]
+
+
+def comparison_actions(session, rng):
+    """
+    Returns the next interaction on the Player Comparison page, see leaders_actions.
+    """
+    action = rng.choice(["radar player", "radar template", "percentile player", "percentile template",
+                         "similar player"])
+    kind, label = {"radar player": ("selectbox", rng.choice(["Select player:", "Select Player:"])),
+                   "radar template": ("radio", "Select a template:"),
+                   "percentile player": ("selectbox", rng.choice(["Select Player", "Select player"])),
+                   "percentile template": ("radio", "Select a Template:"),
+                   "similar player": ("selectbox", "Find players like:")}[action]
+    return action, [lambda: choose(session, kind, label, rng)]
+
+
+ACTIONS = {"Stat Leaders": leaders_actions,
+           "Plot Metrics": metrics_actions,
+           "Player Comparison": comparison_actions}
+
+
+def run_session(number, url, steps, seed, think, timeout):
+    """
+    Runs one scripted session.\n
+
+    Args:
+        number - Session number.
+        url - Server websocket URL, e.g. ws://127.0.0.1:8599.
+        steps - Number of interactions.
+        seed - Seed of the session's choices.
+        think - Seconds the session waits between interactions.
+        timeout - Seconds a rerun may take before it counts as failed.
+
+    Returns:
+        The session, still connected, and a record per rerun: session, page, action, ms, bytes and error.
+    """
+    rng = random.Random(seed)
+    session = Session(url, rng.choice(PAGES), timeout)
+    reruns = []
+
+    def rerun(action):
+        ms, received, error = session.rerun()
+        reruns.append({"session": number, "page": session.page, "action": action, "ms": ms, "bytes": received,
+                       "error": error})
+        return error is None
+
+    rerun("open")
+    for _ in range(steps):
+        time.sleep(think)
+        if rng.random() < PAGE_SWITCH:
+            session.page = rng.choice([page for page in PAGES if page != session.page])
+            rerun("page")
+            continue
+        try:
+            action, interaction = ACTIONS[session.page](session, rng)
+            for step in interaction:
+                step()
+                if not rerun(action):
+                    break
+        except (LookupError, StopIteration) as error:
+            # The page didn't draw a widget the action needs, e.g. after a failed rerun.
+            reruns.append({"session": number, "page": session.page, "action": "interact", "ms": None,
+                           "bytes": 0, "error": str(error) or "missing widget"})
+    return session, reruns
+
+
+def start_server(port):
+    """
+    Starts a Streamlit server for app.py and waits until it is healthy.
+
+    Returns:
+        The server process.
+    """
+    server = subprocess.Popen([sys.executable, "-m", "streamlit", "run", APP, "--server.headless", "true",
+                               "--server.port", str(port), "--server.fileWatcherType", "none",
+                               "--browser.gatherUsageStats", "false"],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(120):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1):
+                return server
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.5)
+    server.kill()
+    raise RuntimeError(f"Streamlit server didn't start on port {port}")
+
+
+def rss_mb(pid):
+    """
+    Returns a process' current resident memory, or None where it can't be read.
+    """
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+def latencies(reruns):
+    """
+    Summarizes rerun latencies: count, p50, p95, p99 and max, in milliseconds.
+    """
+    ms = np.array([rerun["ms"] for rerun in reruns])
+    if not len(ms):
+        return {"reruns": 0}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"reruns": len(ms), "p50_ms": round(p50, 1), "p95_ms": round(p95, 1), "p99_ms": round(p99, 1),
+            "max_ms": round(ms.max(), 1)}
+
+
+def run_level(sessions, url, pid, steps, seed, think, timeout):
+    """
+    Runs sessions concurrently and summarizes their reruns.\n
+
+    Args:
+        sessions - Number of concurrent sessions.
+        url, steps, think, timeout - See run_session.
+        pid - Server process, whose memory is measured. None to skip it.
+        seed - Seed of the first session; session i uses seed + i.
+
+    Returns:
+        The level's result record.
+    """
+    results = [(None, [])] * sessions
+    rss = rss_mb(pid)
+
+    def target(i):
+        try:
+            results[i] = run_session(i, url, steps, seed + i, think, timeout)
+        except Exception as error:
+            results[i] = (None, [{"session": i, "page": None, "action": "connect", "ms": None, "bytes": 0,
+                                  "error": f"{type(error).__name__}: {error}"}])
+
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    # Measured while every session is still connected, so their state on the server is counted.
+    growth = rss_mb(pid) - rss if rss is not None else None
+    for session, _ in results:
+        if session is not None:
+            session.close()
+
+    everything = [rerun for _, reruns in results for rerun in reruns]
+    reruns = [rerun for rerun in everything if rerun["ms"] is not None]
+    errors = [rerun for rerun in everything if rerun["error"]]
+    record = {"sessions": sessions, "steps": steps, "think_s": think, "wall_s": round(elapsed, 3),
+              "reruns_per_s": round(len(reruns) / elapsed, 2), **latencies(reruns),
+              "kb_per_rerun": round(np.mean([rerun["bytes"] for rerun in reruns]) / 1024, 1) if reruns else None,
+              "pages": {page: latencies([rerun for rerun in reruns if rerun["page"] == page]) for page in PAGES},
+              "rss_growth_mb": None if growth is None else round(growth, 1),
+              "rss_growth_per_session_mb": None if growth is None else round(growth / sessions, 2),
+              "errors": len(errors),
+              "first_errors": sorted({f"{rerun['page']}, {rerun['action']}: {rerun['error']}" for rerun in errors})[:5]}
+
+    memory = "" if growth is None else f"  rss +{record['rss_growth_per_session_mb']:.1f} MB/session"
+    print(f"{sessions:>4} sessions  {record['reruns']:>5} reruns  {record['reruns_per_s']:>7.2f}/s  "
+          f"p50 {record.get('p50_ms', 0):>8.1f}  p95 {record.get('p95_ms', 0):>8.1f}  "
+          f"p99 {record.get('p99_ms', 0):>8.1f} ms{memory}  errors {record['errors']}")
+    for page, summary in record["pages"].items():
+        if summary["reruns"]:
+            print(f"      {page:<18} {summary['reruns']:>5} reruns  p50 {summary['p50_ms']:>8.1f}  "
+                  f"p95 {summary['p95_ms']:>8.1f}  p99 {summary['p99_ms']:>8.1f} ms")
+    for error in record["first_errors"]:
+        print(f"      error: {error}")
+    return record
+
+
+def compare(results, baseline):
+    """
+    Prints the change in throughput and tail latency of every level against an earlier run.
+    """
+    before = {record["sessions"]: record for record in baseline["results"]}
+    print(f"\nAgainst {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    for record in results:
+        old = before.get(record["sessions"])
+        if old is None or not old["reruns"] or not record["reruns"]:
+            continue
+        print(f"{record['sessions']:>4} sessions  {old['reruns_per_s']:>7.2f}/s -> {record['reruns_per_s']:>7.2f}/s  "
+              f"p95 {old['p95_ms']:.1f} -> {record['p95_ms']:.1f} ms  p99 {old['p99_ms']:.1f} -> {record['p99_ms']:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the dashboard with concurrent sessions.")
+    parser.add_argument("--sessions", nargs="+", type=int, default=[1, 4, 16], help="Concurrent sessions per level.")
+    parser.add_argument("--steps", type=int, default=20, help="Interactions per session.")
+    parser.add_argument("--think", type=float, default=0, help="Seconds a session waits between interactions.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds before a rerun counts as failed.")
+    parser.add_argument("--url", default=None, help="Websocket URL of a running server, e.g. ws://host:8501. "
+                                                   "Defaults to starting one.")
+    parser.add_argument("--port", type=int, default=8599, help="Port of the server started when no --url is given.")
+    parser.add_argument("--output", default=None, help="Results file. Defaults to benchmarks/loadtest-<timestamp>.json.")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against.")
+    parser.add_argument("--cold", action="store_true",
+                        help="Remove the cached workbooks and shared frames before starting the server.")
+    args = parser.parse_args()
+    if args.cold and args.url:
+        parser.error("--cold needs the server started here, not --url")
+    if args.cold:
+        shutil.rmtree(functions.CACHE_DIR, ignore_errors=True)
+
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    server = None if args.url else start_server(args.port)
+    url = args.url or f"ws://127.0.0.1:{args.port}"
+    pid = server.pid if server else None
+    try:
+        start = time.perf_counter()
+        session = Session(url, PAGES[0], args.timeout)
+        warmup = {}
+        for page in PAGES:
+            session.page = page
+            warmup[page], _, error = session.rerun()
+            if error is not None:
+                raise RuntimeError(f"{page} failed while warming up: {error}")
+        session.close()
+        print(f"Warmed up{' from a cold cache' if args.cold else ''} in {time.perf_counter() - start:.1f}s")
+
+        results = [run_level(sessions, url, pid, args.steps, args.seed, args.think, args.timeout)
+                   for sessions in args.sessions]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {"timestamp": timestamp, "commit": git_commit(), "python": platform.python_version(),
+              "machine": platform.machine(), "cpus": os.cpu_count(), "url": args.url, "cold": args.cold, "warmup_ms": warmup,
+              "results": results}
+    output = args.output or os.path.join("benchmarks", f"loadtest-{timestamp}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
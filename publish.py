@@ -0,0 +1,56 @@
+"""
+Builds every season's shared frames once, so that dashboard and API workers only ever attach to them.
+
+    python publish.py                       # publish every season, then exit
+    python publish.py --watch 60            # republish whenever a workbook changes, checking every minute
+
+The raw and per 90 frames and the default percentile tables, overall and by position, are published in
+functions.SHARED_DIR, see functions.publish_frame. Any number of Streamlit or API processes on the machine
+then memory-map the same copy instead of each building its own; a worker that starts before they are
+published builds and publishes them itself, so running this is optional, it only moves the build out of
+the first request.
+"""
+import argparse
+import time
+
+import functions
+
+
+def publish(season):
+    """
+    Publishes a season's shared frames, if they aren't already for its current workbooks.\n
+
+    Args:
+        season - Season, a functions.SEASONS key.
+
+    Returns:
+        The time taken, in seconds.
+    """
+    start = time.perf_counter()
+    dataset = functions.Dataset(season)
+    dataset.raw, dataset.per_90, dataset.percentiles(), dataset.percentiles(by_position=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish the dashboard's shared frames.")
+    parser.add_argument("--seasons", nargs="+", default=list(functions.SEASONS), choices=list(functions.SEASONS))
+    parser.add_argument("--watch", type=float, default=None, metavar="SECONDS",
+                        help="Keep running, checking the workbooks for changes at this interval.")
+    args = parser.parse_args()
+
+    versions = {}
+    while True:
+        for season in args.seasons:
+            version = functions.dataset_version(season=season)
+            if versions.get(season) != version:
+                elapsed = publish(season)
+                versions[season] = version
+                print(f"Published {season} ({version}) in {elapsed:.2f}s")
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()
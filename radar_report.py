@@ -0,0 +1,147 @@
+"""
+Renders radar chart packs from the command line, without Streamlit: every pair of players is drawn on
+every requested template, as per 90 and percentile radars, across a pool of worker processes.
+
+    python radar_report.py --pair Rodri "Declan Rice" --pair "Harry Kane" "Erling Haaland" --out reports
+    python radar_report.py pairs.csv --templates "Attacking Template" --format pdf --workers 8
+
+A pairs file is a CSV with player_1 and player_2 columns, and optionally squad_1 and squad_2 for players
+who appear for several squads. One image is written per pair, template and mode, and the throughput is
+reported once every chart is written.
+"""
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+# Charts are only written to files, so no interactive backend is needed in any process.
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import pandas as pd
+
+import functions
+from api import resolve_player
+
+
+MODES = ["per_90","percentile"]
+
+_radar_data = None
+_ranges = None
+_percentiles = None
+
+
+_by_position = False
+
+
+def _init_worker(radar_data, ranges, percentiles, by_position=False):
+    """
+    Hands a worker process the tables every chart is drawn from, once, instead of with every chart.
+    """
+    global _radar_data, _ranges, _percentiles, _by_position
+    _radar_data, _ranges, _percentiles, _by_position = radar_data, ranges, percentiles, by_position
+
+
+def render_chart(template, mode, player_1, player_2, path):
+    """
+    Draws one radar chart and writes it to path, in the format of its extension.\n
+
+    Args:
+        template - Radar template.
+        mode - "per_90" or "percentile".
+        player_1, player_2 - (Player, Squad) keys.
+        path - Output file.
+
+    Returns:
+        The path written.
+    """
+    params = functions.TEMPLATES[template]
+    if mode == "percentile":
+        fig = functions.percentile_comparison_radar(rdat=_percentiles[params], player_1=player_1, player_2=player_2,
+                                                    by_position=_by_position)
+    else:
+        fig = functions.comparison_radar(rdat=_radar_data[params], player_1=player_1, player_2=player_2, ranges=_ranges)
+    fig.savefig(path, bbox_inches="tight")
+    plt.close(fig)
+    return path
+
+
+def slug(text):
+    """
+    Turns a name into a file name friendly string, e.g. "Attacking Template" -> "attacking-template".
+    """
+    return re.sub(r"[^\w]+", "-", text, flags=re.UNICODE).strip("-").lower()
+
+
+def read_pairs(path):
+    """
+    Reads player pairs from a CSV file.\n
+
+    Args:
+        path - CSV with player_1 and player_2 columns, and optionally squad_1 and squad_2.
+
+    Returns:
+        A list of (player_1, squad_1, player_2, squad_2), squads being None when not given.
+    """
+    pairs = pd.read_csv(path, dtype=str)
+    pairs = pairs.reindex(columns=["player_1","squad_1","player_2","squad_2"])
+    pairs = pairs.astype(object).where(pairs.notna(), None)
+    return list(pairs.itertuples(index=False, name=None))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render radar charts for many player pairs.")
+    parser.add_argument("pairs", nargs="?", help="CSV file of player pairs.")
+    parser.add_argument("--pair", nargs=2, action="append", default=[], metavar=("PLAYER_1", "PLAYER_2"),
+                        help="A pair of players to compare. Can be repeated.")
+    parser.add_argument("--templates", nargs="+", default=list(functions.TEMPLATES), choices=list(functions.TEMPLATES))
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--format", default="png", choices=["png","pdf","svg"])
+    parser.add_argument("--out", default="radar_reports", help="Output directory.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes. Defaults to the number of CPUs.")
+    parser.add_argument("--season", default=functions.CURRENT_SEASON, choices=list(functions.SEASONS))
+    parser.add_argument("--min-minutes", type=int, default=0, help="Player pool of the percentile radars.")
+    parser.add_argument("--by-position", action="store_true",
+                        help="Rank the percentile radars' players against their own position only.")
+    args = parser.parse_args()
+
+    pairs = (read_pairs(args.pairs) if args.pairs else []) + [(p1, None, p2, None) for p1, p2 in args.pair]
+    if not pairs:
+        parser.error("no player pairs given")
+
+    # Only the per 90 frame is built, from the raw sheets, and a percentile-only run reads none once its
+    # table is stored.
+    dataset = functions.Dataset(args.season)
+    radar_data, ranges = dataset.radar if "per_90" in args.modes else (None, None)
+    percentiles = (dataset.percentiles(min_minutes=args.min_minutes, by_position=args.by_position)
+                   if "percentile" in args.modes else None)
+
+    os.makedirs(args.out, exist_ok=True)
+    jobs = []
+    for player_1, squad_1, player_2, squad_2 in pairs:
+        for mode in args.modes:
+            index = percentiles.index if mode == "percentile" else radar_data.index
+            try:
+                key_1 = resolve_player(index, player_1, squad_1)
+                key_2 = resolve_player(index, player_2, squad_2)
+            except KeyError as error:
+                print(f"Skipping {player_1} vs {player_2} ({mode}): {error.args[0]}")
+                continue
+            for template in args.templates:
+                # Squads are part of the name, so that namesakes at different squads don't overwrite each other.
+                name = f"{slug(' '.join(key_1))}_vs_{slug(' '.join(key_2))}_{slug(template)}_{mode}.{args.format}"
+                jobs.append((template, mode, key_1, key_2, os.path.join(args.out, name)))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                             initargs=(radar_data, ranges, percentiles, args.by_position)) as pool:
+        written = list(pool.map(render_chart, *zip(*jobs))) if jobs else []
+    elapsed = time.perf_counter() - start
+
+    rate = len(written) / elapsed if elapsed else 0
+    print(f"Rendered {len(written)} charts to {args.out} in {elapsed:.1f}s ({rate:.1f} charts/s)")
+
+
+if __name__ == "__main__":
+    main()
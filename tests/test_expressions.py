@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+import expressions
+
+
+COLUMNS = ["Goals Scored","Assists"]
+
+
+@pytest.mark.parametrize("source", ["`Goals Scored` * _0", "_0", "Assists + __builtins__", "min(Assists)",
+                                    "max(Assists, Assists, Assists)", "sqrt()", "abs + 1"])
+def test_invalid_expressions_are_rejected_when_compiled(source):
+    with pytest.raises(ValueError):
+        expressions.Expression(source, COLUMNS)
+
+
+def test_expression_evaluates_over_columns():
+    metric = expressions.Expression("max(`Goals Scored`, Assists) / Assists", COLUMNS)
+    values = {"Goals Scored": np.array([2, 1, np.nan], dtype="float32"),
+              "Assists": np.array([1, 0, 4], dtype="float32")}
+    np.testing.assert_array_equal(metric(values), np.array([2, np.nan, 1], dtype="float32"))
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import functions
+
+
+def pandas_percentiles(matrix, groups):
+    frame = pd.DataFrame(matrix.astype("float64"))
+    if groups is None:
+        return frame.rank(pct=True).to_numpy() * 100
+    return frame.groupby(groups).rank(pct=True).to_numpy() * 100
+
+
+def awkward_matrix(rows, columns, seed=0):
+    # Few distinct values, so that most values are tied, along with missing values, infinities and both zeros.
+    rng = np.random.default_rng(seed)
+    matrix = rng.integers(-3, 4, size=(rows, columns)).astype("float32")
+    matrix[rng.random(matrix.shape) < 0.1] = np.nan
+    matrix[rng.random(matrix.shape) < 0.05] = np.inf
+    matrix[rng.random(matrix.shape) < 0.05] = -np.inf
+    matrix[rng.random(matrix.shape) < 0.1] = -0.0
+    matrix[:, -1] = rng.normal(size=rows).astype("float32")
+    return matrix
+
+
+@pytest.mark.parametrize("grouped", [False, True])
+def test_rank_percentiles_matches_pandas(grouped):
+    matrix = awkward_matrix(1000, 6)
+    groups = None
+    if grouped:
+        groups = np.arange(len(matrix)) % 5
+        # Group 4 only has missing values.
+        matrix[groups == 4] = np.nan
+    np.testing.assert_allclose(functions.rank_percentiles(matrix, groups), pandas_percentiles(matrix, groups),
+                               rtol=0, atol=1e-4)
+
+
+def test_rank_percentiles_matches_pandas_in_chunks():
+    matrix = awkward_matrix(500, 7, seed=1)
+    groups = np.arange(len(matrix)) % 3
+    np.testing.assert_allclose(functions.rank_percentiles(matrix, groups, chunk_size=1000),
+                               pandas_percentiles(matrix, groups), rtol=0, atol=1e-4)
+
+
+def test_rank_percentiles_matches_pandas_when_keys_cant_be_packed():
+    # 2**16 groups need 16 bits and 2**17 rows 17 more, past the 32 left beside each value's bits.
+    rows = 2**17
+    matrix = awkward_matrix(rows, 2, seed=2)
+    groups = np.arange(rows) // 2
+    np.testing.assert_allclose(functions.rank_percentiles(matrix, groups), pandas_percentiles(matrix, groups),
+                               rtol=0, atol=1e-4)
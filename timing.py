@@ -0,0 +1,143 @@
+"""
+Timing spans for the dashboard's hot paths.
+
+A span times one pipeline stage, e.g. a merge or a chart render, and spans nest. Spans are only recorded
+while timing is enabled for the current thread, with start_run, or for every thread with the
+DASHBOARD_TIMING=1 environment variable; otherwise span and timed hand back the plain call and cost a
+flag check. Streamlit runs each session's reruns on its own thread, so every rerun gets its own
+breakdown, and every recorded span also goes to a bounded process-wide log that can be exported.
+"""
+import collections
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+
+ALWAYS = os.environ.get("DASHBOARD_TIMING") == "1"
+
+# Process-wide log of the most recent spans, across runs and threads.
+LOG = collections.deque(maxlen=10000)
+
+_local = threading.local()
+_runs = itertools.count(1)
+
+
+class _Span:
+    """
+    Context manager recording one span.
+    """
+    __slots__ = ("name", "start", "depth")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.depth = getattr(_local, "depth", 0)
+        _local.depth = self.depth + 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        _local.depth = self.depth
+        record = {"run": getattr(_local, "run", None), "name": self.name, "depth": self.depth,
+                  "time": time.time() - elapsed, "ms": round(elapsed * 1000, 3)}
+        spans = getattr(_local, "spans", None)
+        if spans is not None:
+            spans.append(record)
+        LOG.append(record)
+        return False
+
+
+class _NoSpan:
+    """
+    Context manager doing nothing, handed out while timing is disabled.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enabled():
+    """
+    Checks whether spans are recorded on the current thread.
+    """
+    return ALWAYS or getattr(_local, "spans", None) is not None
+
+
+def span(name):
+    """
+    Times a block: "with timing.span('merge'): ...".\n
+
+    Args:
+        name - Span name.
+
+    Returns:
+        A context manager, which records nothing while timing is disabled.
+    """
+    return _Span(name) if enabled() else _NO_SPAN
+
+
+def timed(func):
+    """
+    Decorator timing every call of a function as a span named after it.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled():
+            return func(*args, **kwargs)
+        with _Span(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def start_run(enable=ALWAYS):
+    """
+    Starts a new run, e.g. a Streamlit rerun, on the current thread.\n
+
+    Args:
+        enable - Record this run's spans. DASHBOARD_TIMING=1 records them regardless.
+    """
+    _local.run = next(_runs)
+    # The run's own total is the only span at depth 0.
+    _local.depth = 1
+    _local.spans = [] if enable or ALWAYS else None
+    _local.start = time.perf_counter()
+
+
+def finish_run(name="run"):
+    """
+    Ends the current thread's run, recording its total duration as a span.\n
+
+    Args:
+        name - Name of the total's span.
+
+    Returns:
+        The run's spans, in the order they finished, the total last.
+    """
+    spans = getattr(_local, "spans", None)
+    if spans is None:
+        return []
+    elapsed = time.perf_counter() - _local.start
+    record = {"run": _local.run, "name": name, "depth": 0, "time": time.time() - elapsed, "ms": round(elapsed * 1000, 3)}
+    spans.append(record)
+    LOG.append(record)
+    _local.spans = None
+    return spans
+
+
+def export():
+    """
+    Serializes the process-wide log, one JSON span per line, oldest first.
+    """
+    return "\n".join(json.dumps(record) for record in list(LOG))